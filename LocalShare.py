@@ -3,25 +3,47 @@ import argparse
 import signal
 import sys
 import shutil
+import errno
 # Added Response and mimetypes for streaming support
-from flask import Flask, request, send_file, render_template_string, redirect, url_for, abort, session, jsonify, Response
+from flask import Flask, request, render_template, redirect, url_for, abort, session, jsonify, Response, make_response
+from jinja2 import DictLoader
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import subprocess
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import ClientDisconnected, HTTPException
+from werkzeug.sansio import multipart
+from werkzeug.http import parse_date, is_resource_modified, http_date
 import zipfile
 import io
 import urllib.request
+import urllib.parse
 import re
 import mimetypes
 import tempfile
 import threading
+import select
+import struct
+import zlib
+import unicodedata
+import collections
+import hashlib
+import uuid
+import bisect
+import base64
+import json
+import concurrent.futures
+import functools
+import asyncio
+import importlib.util
 
 app = None
 shared_dir = ""
+cache_dir = ""
 connected_ips = set()
-upload_sessions = {}  # Track active uploads for cancellation
-upload_lock = threading.Lock()
+upload_sessions = {}  # session id -> UploadSession
+upload_lock = threading.Lock()  # guards the dict only, never held while copying
 
 # ---------- UPDATE FEATURE ----------
 SCRIPT_URL = "https://raw.githubusercontent.com/jobayer1n1/LocalShare/main/LocalShare.py"
@@ -87,6 +109,8 @@ def cleanup_shared_files():
             print("Cleanup completed successfully!")
         except Exception as e:
             print(f"Error during cleanup: {e}")
+    if cache_dir and os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
 
 def signal_handler(signum, frame):
     print(f"\nReceived signal {signum}. Shutting down server...")
@@ -101,49 +125,414 @@ def register_signal_handlers():
         pass
 
 
+# ---------- DIRECTORY SIZE INDEX ----------
+class DirSizeIndex:
+    # Per-directory aggregate sizes and file counts, keyed by absolute path.
+    # A directory's own entries are rescanned when its mtime changes. Rewriting
+    # or appending to a file in place doesn't touch that mtime, so unless a
+    # watcher reports every write (`rescan_entries` off), entries are also
+    # rescanned once `revalidate_after` has passed.
+    def __init__(self, revalidate_after=30.0):
+        self.revalidate_after = revalidate_after
+        self.rescan_entries = True
+        self._nodes = {}
+        self._lock = threading.RLock()
+
+    def totals(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            return self._totals(path, time.time())
+
+    def invalidate(self, path):
+        # Called after something under `path` was created, changed or removed
+        path = os.path.abspath(path)
+        with self._lock:
+            stack = [path]
+            while stack:
+                node_path = stack.pop()
+                node = self._nodes.pop(node_path, None)
+                if node is not None:
+                    stack.extend(os.path.join(node_path, name) for name in node['subdirs'])
+            parent = os.path.dirname(path)
+            node = self._nodes.get(parent)
+            if node is not None:
+                node['mtime'] = None  # force a rescan of the direct entries
+            while True:
+                node = self._nodes.get(parent)
+                if node is not None:
+                    node['total'] = None
+                up = os.path.dirname(parent)
+                if up == parent:
+                    break
+                parent = up
+
+    def _totals(self, path, now):
+        node = self._nodes.get(path)
+        if node is not None and node['total'] is not None and now - node['checked'] < self.revalidate_after:
+            return node['total']
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._nodes.pop(path, None)
+            return (0, 0)
+        if (node is None or node['mtime'] != st.st_mtime_ns or
+                (self.rescan_entries and now - node['scanned'] >= self.revalidate_after)):
+            node = self._scan(path, st, now)
+        size, count = node['size'], node['count']
+        for name in node['subdirs']:
+            sub_size, sub_count = self._totals(os.path.join(path, name), now)
+            size += sub_size
+            count += sub_count
+        node['total'] = (size, count)
+        node['checked'] = now
+        return node['total']
+
+    def _scan(self, path, st, now):
+        size = 0
+        count = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            # Same rule as os.walk: symlinked dirs are not followed
+                            if not entry.is_symlink():
+                                subdirs.append(entry.name)
+                            continue
+                        size += entry.stat().st_size
+                        count += 1
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        node = {'mtime': st.st_mtime_ns, 'size': size, 'count': count,
+                'subdirs': subdirs, 'total': None, 'checked': 0, 'scanned': now}
+        self._nodes[path] = node
+        return node
+
+dir_size_index = DirSizeIndex()
+# ------------------------------------
+
+
+# ---------- LISTING WATCHER ----------
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+
+LISTING_CACHE_SIZE = 64
+
+
+class ListingWatcher:
+    # Keeps pre-sorted directory listings warm for index() and /api/list: the
+    # share root always, plus the most recently browsed subdirectories in a
+    # bounded LRU. Changes are picked up with inotify on Linux and by polling
+    # elsewhere, and each listing is also checked against its directory's
+    # mtime. Every rebuild bumps `generation`; concurrent readers share one.
+    def __init__(self, base_dir, poll_interval=2.0, max_listings=LISTING_CACHE_SIZE):
+        self.base_dir = os.path.abspath(base_dir)
+        self.poll_interval = poll_interval
+        self.max_listings = max_listings
+        self.generation = 0
+        self.mode = None
+        self.incomplete = False     # some directories couldn't be watched
+        self._listings = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="listing-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def invalidate(self, path=None):
+        # A change at `path` affects the listings of all its ancestors (shown
+        # directory sizes) and of everything below it
+        if path is None:
+            for listing in list(self._listings.values()):
+                listing['dirty'] = True
+            return
+        path = os.path.abspath(path)
+        dir_size_index.invalidate(path)
+        for dir_path, listing in list(self._listings.items()):
+            if (dir_path == path or path.startswith(dir_path + os.sep) or
+                    dir_path.startswith(path + os.sep)):
+                listing['dirty'] = True
+
+    def snapshot(self, dir_path=None):
+        with self._lock:
+            listing = self._listing(dir_path or self.base_dir)
+            return listing['files'], listing['generation']
+
+    def view(self, sort, kind=None, dir_path=None):
+        # Entries of one type (or all) in ascending `sort` order, with their
+        # sort keys for bisecting; built once per listing generation
+        with self._lock:
+            listing = self._listing(dir_path or self.base_dir)
+            view = listing['views'].get((sort, kind))
+            if view is None:
+                entries = [f for f in listing['files'] if kind is None or getattr(f, 'is_' + kind)]
+                sort_key = LISTING_SORT_KEYS[sort]
+                entries.sort(key=sort_key)
+                view = (entries, [sort_key(f) for f in entries])
+                listing['views'][(sort, kind)] = view
+            return view, listing['generation']
+
+    def _listing(self, dir_path):
+        dir_path = os.path.abspath(dir_path)
+        listing = self._listings.get(dir_path)
+        try:
+            mtime = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        # Polling (or inotify short of watches) can't see every change deep
+        # in the tree, so let directory sizes expire together with the size index
+        stale = (listing is not None and dir_size_index.rescan_entries and
+                 time.time() - listing['built_at'] > dir_size_index.revalidate_after)
+        if listing is None or listing['dirty'] or listing['mtime'] != mtime or stale:
+            listing = self._build(dir_path, mtime)
+        self._listings.move_to_end(dir_path)
+        while len(self._listings) > self.max_listings:
+            oldest = next(iter(self._listings))
+            if oldest == self.base_dir:
+                self._listings.move_to_end(oldest)  # the root stays warm
+                oldest = next(iter(self._listings))
+            del self._listings[oldest]
+        return listing
+
+    def _build(self, dir_path, mtime):
+        self.generation += 1
+        # Registered before scanning so a change that lands mid-scan marks it dirty
+        listing = {'files': [], 'views': {}, 'mtime': mtime, 'dirty': False,
+                   'built_at': time.time(), 'generation': self.generation}
+        self._listings[dir_path] = listing
+        files = scan_directory(dir_path, self.base_dir)
+        files.sort(key=lambda x: x.mtime, reverse=True)
+        listing['files'] = files
+        return listing
+
+    def _run(self):
+        if sys.platform.startswith("linux"):
+            try:
+                self._watch_inotify()
+                return
+            except Exception as e:
+                print(f"inotify unavailable ({e}), falling back to polling")
+        self._watch_polling()
+
+    def _watch_polling(self):
+        self.mode = 'polling'
+        last = self._signature()
+        self.invalidate()
+        while not self._stop.wait(self.poll_interval):
+            signature = self._signature()
+            if signature != last:
+                for name in set(signature) | set(last):
+                    if signature.get(name) != last.get(name):
+                        self.invalidate(os.path.join(self.base_dir, name))
+            last = signature
+
+    def _signature(self):
+        signature = {}
+        try:
+            with os.scandir(self.base_dir) as it:
+                for entry in it:
+                    if entry.name == UPLOAD_PARTIAL_DIR:
+                        continue  # busy with chunk writes, never listed
+                    try:
+                        st = entry.stat()
+                        signature[entry.name] = (st.st_mtime_ns, st.st_size)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return signature
+
+    def _watch_inotify(self):
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        watches = {}
+
+        def add_tree(top):
+            for dirpath, dirnames, filenames in os.walk(top):
+                if os.path.basename(dirpath) == UPLOAD_PARTIAL_DIR:
+                    dirnames[:] = []
+                    continue  # busy with chunk writes, never listed
+                wd = libc.inotify_add_watch(fd, os.fsencode(dirpath), WATCH_MASK)
+                if wd < 0:
+                    if dirpath == self.base_dir:
+                        raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+                    # e.g. watch limit reached; listings then expire with the
+                    # size index TTL, as when polling
+                    self.incomplete = True
+                    dir_size_index.rescan_entries = True
+                    continue
+                watches[wd] = dirpath
+
+        try:
+            add_tree(self.base_dir)
+            self.mode = 'inotify'
+            # IN_CLOSE_WRITE reports in-place rewrites, so sizes need no TTL
+            dir_size_index.rescan_entries = self.incomplete
+            self.invalidate()
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 1.0)
+                if not ready:
+                    continue
+                data = os.read(fd, 64 * 1024)
+                changed = set()
+                new_dirs = []
+                offset = 0
+                while offset + 16 <= len(data):
+                    wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+                    name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                    offset += 16 + length
+                    if mask & IN_Q_OVERFLOW:
+                        changed.add(self.base_dir)
+                        continue
+                    parent = watches.get(wd)
+                    if parent is None:
+                        continue
+                    if mask & IN_IGNORED:
+                        del watches[wd]
+                        continue
+                    path = os.path.join(parent, os.fsdecode(name)) if name else parent
+                    changed.add(path)
+                    if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                        new_dirs.append(path)
+                for path in new_dirs:
+                    add_tree(path)
+                for path in changed:
+                    self.invalidate(path)
+        finally:
+            os.close(fd)
+
+# ------------------------------------
+
+
+VIDEO_EXTENSIONS = frozenset(['.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v'])
+AUDIO_EXTENSIONS = frozenset(['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma', '.opus'])
+IMAGE_EXTENSIONS = frozenset(['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.ico'])
+SUBTITLE_EXTENSIONS = frozenset(['.srt', '.vtt'])
+
+
+def scan_directory(dir_path, base_dir):
+    # One FileInfo per entry from a single scandir pass
+    rel_dir = os.path.relpath(dir_path, base_dir)
+    files = []
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                if entry.name == UPLOAD_PARTIAL_DIR:
+                    continue
+                try:
+                    files.append(FileInfo(entry, rel_dir))
+                except OSError:
+                    pass  # removed while we were listing
+    except OSError:
+        pass
+    return files
+
+
+# Names are unique within a directory, so every key is a total order
+LISTING_SORT_KEYS = {
+    'name': lambda f: (f.name.lower(), f.name),
+    'size': lambda f: (f.size, f.name),
+    'mtime': lambda f: (f.mtime, f.name),
+}
+LISTING_TYPES = ('video', 'audio', 'image', 'subtitle')
+LISTING_PAGE_MAX = 500
+
+
+def page_listing(entries, keys, after, limit, descending):
+    # Keyset pagination: `after` is the sort key of the last entry the client
+    # has, so pages stay consistent while files come and go
+    if descending:
+        end = bisect.bisect_left(keys, after) if after is not None else len(keys)
+        start = max(0, end - limit)
+        page = entries[start:end][::-1]
+        has_more = start > 0
+    else:
+        start = bisect.bisect_right(keys, after) if after is not None else 0
+        page = entries[start:start + limit]
+        has_more = start + limit < len(keys)
+    return page, has_more
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort):
+    # Raises ValueError for anything that didn't come from encode_cursor
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("malformed cursor")
+    first_type = str if sort == 'name' else (int, float)
+    if (not isinstance(key, list) or len(key) != 2 or isinstance(key[0], bool) or
+            not isinstance(key[0], first_type) or not isinstance(key[1], str)):
+        raise ValueError("malformed cursor")
+    return tuple(key)
+
+
 class FileInfo:
-    def __init__(self, path, base_dir):
-        self.path = path
-        self.name = os.path.basename(path)
-        self.relpath = os.path.relpath(path, base_dir)
-        self.is_dir = os.path.isdir(path)
-        stat = os.stat(path)
-        self.size = stat.st_size if not self.is_dir else self._get_dir_size(path)
+    # One listing row. Listings hold thousands of these for as long as the
+    # directory is cached, so no per-instance __dict__, and everything the
+    # filters and /api/list read is computed once up front
+    __slots__ = ('path', 'name', 'relpath', 'is_dir', 'size', 'mtime', 'ext',
+                 'is_video', 'is_audio', 'is_image', 'is_subtitle', 'can_stream')
+
+    def __init__(self, entry, rel_dir):
+        # entry is an os.DirEntry; its stat result comes straight from the
+        # scandir pass (and is free on Windows)
+        name = entry.name
+        self.path = entry.path
+        self.name = name
+        self.relpath = name if rel_dir == '.' else os.path.join(rel_dir, name)
+        self.is_dir = entry.is_dir()
+        stat = entry.stat()
+        self.size = stat.st_size if not self.is_dir else self._get_dir_size(entry.path)
         self.mtime = stat.st_mtime
-        self.ext = os.path.splitext(self.name)[1].lower()
+        ext = os.path.splitext(name)[1].lower()
+        self.ext = ext
+        self.is_video = ext in VIDEO_EXTENSIONS
+        self.is_audio = ext in AUDIO_EXTENSIONS
+        self.is_image = ext in IMAGE_EXTENSIONS
+        self.is_subtitle = ext in SUBTITLE_EXTENSIONS
+        self.can_stream = self.is_video or self.is_audio or self.is_image
         
     def _get_dir_size(self, path):
-        total = 0
-        try:
-            for dirpath, dirnames, filenames in os.walk(path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    if os.path.exists(fp):
-                        total += os.path.getsize(fp)
-        except:
-            pass
-        return total
-    
-    @property
-    def is_video(self):
-        return self.ext in ['.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v']
-    
-    @property
-    def is_audio(self):
-        return self.ext in ['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma', '.opus']
-    
-    @property
-    def is_image(self):
-        return self.ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.ico']
-    
-    @property
-    def is_subtitle(self):
-        return self.ext in ['.srt', '.vtt']
+        return dir_size_index.totals(path)[0]
     
-    @property
-    def can_stream(self):
-        return self.is_video or self.is_audio or self.is_image
-        
+    def to_json(self):
+        return {'name': self.name, 'path': self.relpath.replace(os.sep, '/'),
+                'is_dir': self.is_dir, 'size': self.size, 'size_h': self.size_h,
+                'mtime': self.mtime, 'mtime_h': self.mtime_h,
+                'is_video': self.is_video, 'is_audio': self.is_audio,
+                'is_image': self.is_image, 'is_subtitle': self.is_subtitle,
+                'can_stream': self.can_stream}
+
     @property
     def size_h(self):
         size = self.size
@@ -158,22 +547,1568 @@ class FileInfo:
         return datetime.fromtimestamp(self.mtime).strftime('%Y-%m-%d %H:%M:%S')
 
 
-def build_app(base_dir, allow_delete=False, pin=None):
-    global app, shared_dir
+# ---------- STREAMING ZIP ----------
+ZIP_COMPRESSION_MODES = ('auto', 'store', 'deflate')
+# Media and archive formats that deflate can't shrink; raw formats like .wav,
+# .bmp and .svg are left out on purpose
+ZIP_STORED_EXTENSIONS = ((VIDEO_EXTENSIONS | AUDIO_EXTENSIONS | IMAGE_EXTENSIONS)
+                         - {'.wav', '.bmp', '.svg', '.ico'}) | {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.lz4', '.br',
+    '.jar', '.apk', '.aab', '.ipa', '.docx', '.xlsx', '.pptx', '.odt', '.epub',
+    '.heic', '.avif', '.dmg', '.iso', '.woff', '.woff2'}
+ZIP_SAMPLE_SIZE = 64 * 1024
+
+
+def choose_compression(f, name, mode='auto'):
+    if mode == 'store':
+        return zipfile.ZIP_STORED
+    if mode == 'deflate':
+        return zipfile.ZIP_DEFLATED
+    if os.path.splitext(name)[1].lower() in ZIP_STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    # Unknown type: a fast compression of the first block tells us whether
+    # deflating the rest is worth the CPU
+    sample = f.read(ZIP_SAMPLE_SIZE)
+    f.seek(0)
+    if not sample or len(zlib.compress(sample, 1)) > len(sample) * 0.9:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+class ZipStream:
+    # Produces a ZIP archive as a sequence of byte chunks while walking the tree.
+    # Every member is written with a data descriptor (CRC and sizes follow the
+    # data), so nothing has to be buffered or seeked, and ZIP64 records are used
+    # once sizes, offsets or the member count outgrow the classic format.
+    chunk_size = 1024 * 1024
+
+    def __init__(self):
+        self.offset = 0
+        self.entries = []
+
+    def _out(self, data):
+        self.offset += len(data)
+        return data
+
+    def _member(self, st, arcname, compress_type):
+        dos_time, dos_date = _dos_datetime(st.st_mtime)
+        return {'name': arcname.replace(os.sep, '/').encode('utf-8'),
+                'method': compress_type, 'time': dos_time, 'date': dos_date,
+                'zip64': st.st_size * 1.05 > zipfile.ZIP64_LIMIT,
+                'attr': (st.st_mode & 0xFFFF) << 16,
+                'crc': 0, 'raw': 0, 'comp': 0, 'offset': 0}
+
+    def _header(self, member):
+        member['offset'] = self.offset
+        name = member['name']
+        flags = 0x08 | 0x800  # data descriptor, UTF-8 name
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if member['zip64'] else b''
+        placeholder = 0xFFFFFFFF if member['zip64'] else 0
+        return self._out(struct.pack('<4s5H3I2H', b'PK\x03\x04', 45 if member['zip64'] else 20,
+                                     flags, member['method'], member['time'], member['date'],
+                                     0, placeholder, placeholder, len(name), len(extra))
+                         + name + extra)
+
+    def _data(self, member, data):
+        member['comp'] += len(data)
+        return self._out(data)
+
+    def _descriptor(self, member):
+        self.entries.append(member)
+        if member['zip64']:
+            return self._out(struct.pack('<4sIQQ', b'PK\x07\x08', member['crc'],
+                                         member['comp'], member['raw']))
+        return self._out(struct.pack('<4sIII', b'PK\x07\x08', member['crc'],
+                                     member['comp'], member['raw']))
+
+    def add_file(self, f, st, arcname, compress_type=zipfile.ZIP_DEFLATED):
+        member = self._member(st, arcname, compress_type)
+        yield self._header(member)
+        compressor = None
+        if compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        for data in _read_blocks(f, st.st_size, self.chunk_size):
+            member['raw'] += len(data)
+            member['crc'] = zlib.crc32(data, member['crc'])
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield self._data(member, data)
+        if compressor:
+            yield self._data(member, compressor.flush())
+        yield self._descriptor(member)
+
+    def add_files_parallel(self, members, pool, window):
+        # Deflates each member in independent 1 MiB blocks on `pool` (zlib drops
+        # the GIL) and writes them back in order. Every block is primed with the
+        # previous 32 KiB and ends on a sync flush, so the concatenation is one
+        # valid deflate stream. At most `window` blocks are in flight per archive.
+        pending = collections.deque()
+        in_flight = 0
+        try:
+            for f, st, arcname, compress_type in members:
+                member = self._member(st, arcname, compress_type)
+                pending.append(('header', member, None))
+                with f:
+                    tail = b''
+                    for block in _read_blocks(f, st.st_size, self.chunk_size):
+                        member['raw'] += len(block)
+                        member['crc'] = zlib.crc32(block, member['crc'])
+                        if compress_type == zipfile.ZIP_DEFLATED:
+                            job = pool.submit(_deflate_block, block, tail)
+                            tail = block[-32768:]
+                        else:
+                            job = block
+                        pending.append(('data', member, job))
+                        in_flight += 1
+                        while in_flight >= window:
+                            kind, data = self._flush_unit(pending.popleft())
+                            if kind == 'data':
+                                in_flight -= 1
+                            yield data
+                if compress_type == zipfile.ZIP_DEFLATED:
+                    pending.append(('data', member, DEFLATE_END))
+                pending.append(('end', member, None))
+            while pending:
+                yield self._flush_unit(pending.popleft())[1]
+        finally:
+            for kind, member, job in pending:
+                if hasattr(job, 'cancel'):
+                    job.cancel()
+
+    def _flush_unit(self, unit):
+        kind, member, job = unit
+        if kind == 'header':
+            return kind, self._header(member)
+        if kind == 'end':
+            return kind, self._descriptor(member)
+        return kind, self._data(member, job.result() if hasattr(job, 'result') else job)
+
+    def finish(self):
+        cd_offset = self.offset
+        for member in self.entries:
+            name = member['name']
+            fields = []
+            sizes = (member['comp'], member['raw'])
+            if member['zip64'] or max(sizes) >= 0xFFFFFFFF:
+                fields += [member['raw'], member['comp']]
+                sizes = (0xFFFFFFFF, 0xFFFFFFFF)
+            offset = member['offset']
+            if offset >= 0xFFFFFFFF:
+                fields.append(offset)
+                offset = 0xFFFFFFFF
+            extra = b''
+            if fields:
+                extra = struct.pack('<HH%dQ' % len(fields), 1, 8 * len(fields), *fields)
+            version = 45 if fields else 20
+            yield self._out(struct.pack('<4s6H3I5H2I', b'PK\x01\x02', (3 << 8) | version, version,
+                                        0x08 | 0x800, member['method'], member['time'],
+                                        member['date'], member['crc'], sizes[0], sizes[1],
+                                        len(name), len(extra), 0, 0, 0, member['attr'], offset)
+                            + name + extra)
+
+        cd_size = self.offset - cd_offset
+        count = len(self.entries)
+        if count >= 0xFFFF or cd_size >= 0xFFFFFFFF or cd_offset >= 0xFFFFFFFF:
+            zip64_end_offset = self.offset
+            yield self._out(struct.pack('<4sQ2H2I4Q', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                                        count, count, cd_size, cd_offset))
+            yield self._out(struct.pack('<4sIQI', b'PK\x06\x07', 0, zip64_end_offset, 1))
+        yield self._out(struct.pack('<4s4H2IH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF),
+                                    min(count, 0xFFFF), min(cd_size, 0xFFFFFFFF),
+                                    min(cd_offset, 0xFFFFFFFF), 0))
+
+
+# Final empty block that terminates a deflate stream built from sync-flushed parts
+DEFLATE_END = zlib.compressobj(6, zlib.DEFLATED, -15).flush()
+
+
+def _deflate_block(data, zdict):
+    if zdict:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _read_blocks(f, size, block_size):
+    remaining = size  # never read past the size the header was sized for
+    while remaining > 0:
+        data = f.read(min(block_size, remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00:00, the earliest DOS date
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def stream_zip_directory(root, compression='auto', pool=None, window=1):
+    zs = ZipStream()
+    if pool is not None and compression != 'store':
+        yield from zs.add_files_parallel(_zip_members(root, compression), pool, window)
+    else:
+        for f, st, arcname, compress_type in _zip_members(root, compression):
+            with f:
+                yield from zs.add_file(f, st, arcname, compress_type)
+    yield from zs.finish()
+
+
+def _zip_members(root, compression):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != UPLOAD_PARTIAL_DIR)
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            try:
+                f = open(file_path, 'rb')
+            except OSError:
+                continue  # removed or unreadable since the walk listed it
+            try:
+                st = os.fstat(f.fileno())
+                compress_type = choose_compression(f, filename, compression)
+            except OSError:
+                f.close()
+                continue
+            yield f, st, os.path.relpath(file_path, root), compress_type
+
+
+def set_attachment(rv, download_name):
+    # Same Content-Disposition encoding send_file uses for non-ASCII names
+    try:
+        download_name.encode('ascii')
+        names = {'filename': download_name}
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple,
+                 'filename*': "UTF-8''" + urllib.parse.quote(download_name, safe="!#$&+-.^_`|~")}
+    rv.headers.set('Content-Disposition', 'attachment', **names)
+    return rv
+# ------------------------------------
+
+
+# ---------- BANDWIDTH ----------
+# Priority classes, most latency-sensitive first: media players pulling
+# /view ranges, then downloads and folder ZIPs, then uploads
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_UPLOAD = 2
+PRIORITY_CLASSES = 3
+BANDWIDTH_QUANTUM = 64 * 1024       # bytes paced at a time while limited
+BANDWIDTH_BURST_SECONDS = 0.25
+BANDWIDTH_FLOOR = 0.1               # share lower classes keep under full load
+BANDWIDTH_CLIENTS = 1024
+
+
+class PriorityBucket:
+    # Token bucket whose backlog is paid off in priority order. Each
+    # transfer reserves bytes up front and sleeps for the returned delay, so
+    # concurrent transfers interleave quantum by quantum (fair sharing), and
+    # interactive bytes only queue behind other interactive bytes. Lower
+    # classes still drain at BANDWIDTH_FLOOR of the rate so a busy player
+    # can't stall a download forever.
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.burst = max(self.rate * BANDWIDTH_BURST_SECONDS, BANDWIDTH_QUANTUM)
+        self.credit = self.burst
+        self.debt = [0.0] * PRIORITY_CLASSES
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _drain(self, now):
+        budget = (now - self.stamp) * self.rate
+        self.stamp = now
+        floor = budget * BANDWIDTH_FLOOR
+        for priority in range(1, PRIORITY_CLASSES):
+            paid = min(self.debt[priority], floor)
+            self.debt[priority] -= paid
+            budget -= paid
+        for priority in range(PRIORITY_CLASSES):
+            paid = min(self.debt[priority], budget)
+            self.debt[priority] -= paid
+            budget -= paid
+        # Leftover capacity only exists once every class is paid off
+        self.credit = min(self.burst, self.credit + budget)
+
+    def reserve(self, n, priority):
+        # Seconds to wait before sending n bytes
+        with self.lock:
+            self._drain(time.monotonic())
+            taken = min(self.credit, n)
+            self.credit -= taken
+            self.debt[priority] += n - taken
+            # Queued lower classes take their floor share off the top
+            starved = sum(1 for debt in self.debt[priority + 1:] if debt > 0)
+            delay = sum(self.debt[:priority + 1]) / (self.rate * (1 - BANDWIDTH_FLOOR * starved))
+            if priority:
+                delay = min(delay, self.debt[priority] / (self.rate * BANDWIDTH_FLOOR))
+            return delay
+
+
+class BandwidthScheduler:
+    # A shared bucket for the whole server plus one bucket per client IP
+    def __init__(self, rate=None, client_rate=None):
+        self.shared = PriorityBucket(rate) if rate else None
+        self.client_rate = client_rate
+        self.clients = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def throttle(self, ip, priority):
+        # None when no limit is configured, so unlimited transfers keep their
+        # zero-copy paths
+        if self.shared is None and not self.client_rate:
+            return None
+        own = None
+        if self.client_rate:
+            with self.lock:
+                own = self.clients.get(ip)
+                if own is None:
+                    own = self.clients[ip] = PriorityBucket(self.client_rate)
+                    if len(self.clients) > BANDWIDTH_CLIENTS:
+                        self.clients.popitem(last=False)
+                else:
+                    self.clients.move_to_end(ip)
+        return Throttle(self.shared, own, priority)
+
+
+class Throttle:
+    # One transfer's handle on the scheduler
+    __slots__ = ('shared', 'own', 'priority')
+
+    def __init__(self, shared, own, priority):
+        self.shared = shared
+        self.own = own
+        self.priority = priority
+
+    def reserve(self, n):
+        delay = 0.0
+        for bucket in (self.shared, self.own):
+            if bucket is not None:
+                delay = max(delay, bucket.reserve(n, self.priority))
+        return delay
+
+    def wait(self, n):
+        delay = self.reserve(n)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Throttled:
+    # A response body re-sliced into paced BANDWIDTH_QUANTUM pieces. Other
+    # servers iterate it and sleep in their worker thread; the asyncio
+    # backend unwraps it and sleeps on its event loop instead
+    def __init__(self, chunks, throttle):
+        self.chunks = chunks
+        self.throttle = throttle
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            for piece in quanta(chunk):
+                self.throttle.wait(len(piece))
+                yield piece
+
+    def close(self):
+        if hasattr(self.chunks, 'close'):
+            self.chunks.close()
+
+
+def quanta(chunk):
+    for i in range(0, len(chunk), BANDWIDTH_QUANTUM):
+        yield chunk[i:i + BANDWIDTH_QUANTUM]
+# ------------------------------------
+
+
+# ---------- FILE TRANSFER ----------
+TRANSFER_CHUNK_SIZE = 256 * 1024
+SENDFILE_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def file_body(environ, path, offset, length, use_wrapper=True, throttle=None):
+    # Iterable that sends `length` bytes of `path` starting at `offset`. The
+    # response must carry a matching Content-Length.
+    f = open(path, 'rb', buffering=0)
+    if environ.get('localshare.file_range') and use_wrapper:
+        return FileRange(f, offset, length, throttle)
+    sock = environ.get('werkzeug.socket')
+    if sock is not None and hasattr(os, 'sendfile') and environ.get('wsgi.url_scheme') == 'http':
+        return _sendfile_body(f, sock, offset, length, throttle)
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and use_wrapper and throttle is None:
+        # PEP 3333: servers start at the current position and stop at Content-Length
+        f.seek(offset)
+        return file_wrapper(f, TRANSFER_CHUNK_SIZE)
+    body = _read_body(f, offset, length)
+    return body if throttle is None else Throttled(body, throttle)
+
+
+class FileRange:
+    # A file body the server may send by itself: the asyncio backend hands
+    # it to loop.sendfile, anything else just iterates it
+    def __init__(self, f, offset, length, throttle=None):
+        self.file = f
+        self.offset = offset
+        self.length = length
+        self.throttle = throttle
+
+    def __iter__(self):
+        body = _read_body(self.file, self.offset, self.length)
+        return iter(body if self.throttle is None else Throttled(body, self.throttle))
+
+    def close(self):
+        self.file.close()
+
+
+def _sendfile_body(f, sock, offset, length, throttle=None):
+    with f:
+        # Werkzeug writes the status line and headers on the first (empty)
+        # chunk; the body then goes from the page cache straight to the socket
+        yield b''
+        step = SENDFILE_CHUNK_SIZE if throttle is None else BANDWIDTH_QUANTUM
+        while length > 0:
+            if throttle is not None:
+                throttle.wait(min(length, step))
+            sent = sock.sendfile(f, offset, min(length, step))
+            if not sent:
+                break
+            offset += sent
+            length -= sent
+
+
+def serve_file(path, mimetype=None, as_attachment=False, download_name=None, etag=None,
+               throttle=None):
+    # Full, single-range and multipart/byteranges responses per RFC 7233
+    st = os.stat(path)
+    size = st.st_size
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    etag = etag or file_etag(st)
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+    environ = request.environ
+
+    rv = not_modified(etag, last_modified)
+    if rv is not None:
+        return rv
+
+    ranges = parse_range_header(request.headers.get('Range'), size)
+    if ranges is not None and not if_range_matches(request.headers.get('If-Range'), etag, st.st_mtime):
+        ranges = None  # the client's copy is outdated, send the whole file
+
+    if ranges is None:
+        rv = Response(file_body(environ, path, 0, size, throttle=throttle), 200, mimetype=mimetype,
+                      direct_passthrough=True)
+        rv.content_length = size
+    elif not ranges:
+        rv = Response(status=416)
+        rv.headers['Content-Range'] = f'bytes */{size}'
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        rv = Response(file_body(environ, path, start, end - start + 1, throttle=throttle), 206, mimetype=mimetype,
+                      direct_passthrough=True)
+        rv.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        rv.content_length = end - start + 1
+    else:
+        boundary = uuid.uuid4().hex
+        heads = [(f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                  f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('latin-1')
+                 for start, end in ranges]
+        tail = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+        if throttle is not None and environ.get('localshare.file_range'):
+            # Paced as a whole, so the asyncio backend can sleep on its loop
+            body = Throttled(_multipart_body(environ, path, ranges, heads, tail), throttle)
+        else:
+            body = _multipart_body(environ, path, ranges, heads, tail, throttle)
+        rv = Response(body, 206,
+                      content_type=f'multipart/byteranges; boundary={boundary}',
+                      direct_passthrough=True)
+        rv.content_length = (sum(len(h) for h in heads) + len(tail) +
+                             sum(end - start + 1 for start, end in ranges))
+
+    rv.headers['Accept-Ranges'] = 'bytes'
+    add_validators(rv, etag, last_modified)
+    if as_attachment:
+        set_attachment(rv, download_name or os.path.basename(path))
+    return rv
+
+
+def not_modified(etag, last_modified=None, weak=False):
+    # 304 when If-None-Match / If-Modified-Since show the client's copy is current
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return None
+    return add_validators(Response(status=304), etag, last_modified, weak)
+
+
+def add_validators(rv, etag, last_modified=None, weak=False):
+    rv.set_etag(etag, weak)
+    if last_modified is not None:
+        rv.last_modified = last_modified
+    # Cacheable, but always revalidated: a 304 costs almost nothing on a LAN
+    rv.headers['Cache-Control'] = 'no-cache'
+    return rv
+
+
+def file_etag(st):
+    # Strong validator: changes whenever the file is replaced or rewritten
+    return f'{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}'
+
+
+MAX_RANGES = 16
+
+
+def parse_range_header(header, size):
+    # Returns sorted, coalesced (start, end) pairs; [] when nothing is
+    # satisfiable (416) and None when the header must be ignored (200)
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first = first.strip()
+        last = last.strip()
+        if not sep or not (first or last) or not (first or '0').isdigit() or not (last or '0').isdigit():
+            return None
+        if not first:
+            # Suffix range: the final N bytes, e.g. an MP4 moov atom
+            suffix = int(last)
+            if suffix > 0 and size > 0:
+                ranges.append((max(0, size - suffix), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if last and end < start:
+            return None
+        if start < size:
+            ranges.append((start, min(end, size - 1)))  # an over-long end is clamped
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        # Overlapping ranges and ones separated by less than a part header
+        # are sent as one part
+        if merged and start <= merged[-1][1] + 80:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def if_range_matches(header, etag, mtime):
+    if not header:
+        return True
+    header = header.strip()
+    if header.startswith('"') or header.startswith('W/'):
+        return header == f'"{etag}"'  # If-Range needs a strong match
+    date = parse_date(header)
+    return date is not None and int(date.timestamp()) == int(mtime)
+
+
+def _multipart_body(environ, path, ranges, heads, tail, throttle=None):
+    for (start, end), head in zip(ranges, heads):
+        yield head
+        yield from file_body(environ, path, start, end - start + 1, use_wrapper=False,
+                             throttle=throttle)
+    yield tail
+
+
+def _read_body(f, offset, length):
+    with f:
+        f.seek(offset)
+        while length > 0:
+            # Unbuffered read(): one syscall straight into the bytes object
+            # the WSGI server needs anyway
+            data = f.read(min(length, TRANSFER_CHUNK_SIZE))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+# ------------------------------------
+
+
+# ---------- ARCHIVE CACHE ----------
+# What tempfile.mkstemp(dir=..., suffix='.tmp') names the files being written
+DISK_LRU_TEMP = re.compile(r'tmp[a-z0-9_]{8}\.tmp\Z')
+
+
+class DiskLRU:
+    # Size-bounded set of files under `root`, evicted least recently used first.
+    # With `owned`, a regex matching the names this cache writes, files left
+    # by an earlier run are adopted instead of forgotten
+    def __init__(self, root, max_bytes, owned=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._reserved = 0      # space promised to files still being written
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        if owned is not None:
+            self._adopt(owned)
+
+    def _adopt(self, owned):
+        # Oldest first so they are evicted first; keys are the file names
+        # minus their suffix. Anything else in the directory is left alone.
+        found = []
+        for entry in os.scandir(self.root):
+            if not entry.is_file():
+                continue
+            if DISK_LRU_TEMP.match(entry.name):
+                os.remove(entry.path)  # interrupted write
+                continue
+            if not owned.match(entry.name):
+                continue
+            st = entry.stat()
+            found.append((st.st_mtime, os.path.splitext(entry.name)[0], entry.path))
+        for mtime, key, path in sorted(found):
+            self.put(key, path)
+
+    def path_for(self, key, suffix=''):
+        return os.path.join(self.root, key + suffix)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if not os.path.exists(entry[0]):
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def reserve(self, size):
+        # Claims room for a file about to be written, evicting old entries
+        # if needed; False when it can't fit next to the other reservations
+        with self._lock:
+            if self._reserved + size > self.max_bytes:
+                return False
+            self._reserved += size
+            self._evict()
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self._reserved -= size
+
+    def put(self, key, path):
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (path, size)
+            self._size += size
+            self._evict()
+
+    def _evict(self):
+        # An entry bigger than the whole budget is evicted right away too
+        while self._size + self._reserved > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)), remove=True)
+
+    def _drop(self, key, remove=False):
+        path, size = self._entries.pop(key)
+        self._size -= size
+        if remove:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # still open elsewhere on Windows; removed with the cache dir
+
+
+# Upper bound on a ZIP's bytes beyond its members' data: local header, data
+# descriptor and central directory record with ZIP64 extras, plus the name twice
+ZIP_ENTRY_OVERHEAD = 256
+ZIP_ARCHIVE_OVERHEAD = 1024
+
+
+def tree_fingerprint(root, compression):
+    # Relative paths, sizes and mtimes of everything under `root`, and an
+    # upper bound on the size of its archive (stored size, plus a margin for
+    # deflate's worst case on incompressible data)
+    h = hashlib.sha1(compression.encode())
+    bound = ZIP_ARCHIVE_OVERHEAD
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != UPLOAD_PARTIAL_DIR)
+        bound += ZIP_ENTRY_OVERHEAD + 2 * len(os.fsencode(dirpath))
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            relpath = os.path.relpath(file_path, root)
+            line = f"{relpath}\0{st.st_size}\0{st.st_mtime_ns}\n"
+            h.update(line.encode('utf-8', 'surrogateescape'))
+            bound += st.st_size + st.st_size // 256 + ZIP_ENTRY_OVERHEAD + 2 * len(os.fsencode(relpath))
+    return h.hexdigest(), bound
+
+
+class ArchiveBuild:
+    def __init__(self, path, reserved):
+        self.path = path
+        self.reserved = reserved
+        self.written = 0
+        self.done = False
+        self.error = None
+        self.cond = threading.Condition()
+
+
+class ArchiveCache:
+    # Folder archives on disk, keyed by a fingerprint of the subtree (relative
+    # paths, sizes, mtimes) and the compression mode. An archive is built once
+    # by a background thread; every request, including the first, follows the
+    # file as it grows, so concurrent downloads share one build and a client
+    # that disconnects doesn't waste it. Builds reserve their size bound in
+    # the store up front, and archives that can't fit are streamed uncached.
+    def __init__(self, root, max_bytes):
+        self.store = DiskLRU(root, max_bytes)
+        self._builds = {}
+        self._lock = threading.Lock()
+
+    def open(self, key, bound, make_chunks):
+        # Returns (path, None) for a finished archive, or (None, chunks) to
+        # follow a build that is still running or to stream one that is
+        # too big to cache
+        with self._lock:
+            path = self.store.get(key)
+            if path is not None:
+                return path, None
+            build = self._builds.get(key)
+            if build is None:
+                if not self.store.reserve(bound):
+                    return None, make_chunks()
+                build = ArchiveBuild(self.store.path_for(key, '.zip'), bound)
+                # Written in place rather than renamed at the end: Windows can't
+                # rename a file that followers still have open
+                out = open(build.path, 'wb', buffering=0)
+                self._builds[key] = build
+                threading.Thread(target=self._build, args=(key, build, out, make_chunks),
+                                 name="archive-build", daemon=True).start()
+        return None, self._follow(build)
+
+    def _build(self, key, build, out, make_chunks):
+        try:
+            with out:
+                for chunk in make_chunks():
+                    out.write(chunk)
+                    with build.cond:
+                        build.written += len(chunk)
+                        build.cond.notify_all()
+        except Exception as e:
+            with build.cond:
+                build.error = e
+                build.cond.notify_all()
+            with self._lock:
+                del self._builds[key]
+                self.store.release(build.reserved)
+            try:
+                os.remove(build.path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self.store.release(build.reserved)
+            self.store.put(key, build.path)
+            del self._builds[key]
+        with build.cond:
+            build.done = True
+            build.cond.notify_all()
+
+    def _follow(self, build):
+        with open(build.path, 'rb') as f:
+            pos = 0
+            while True:
+                with build.cond:
+                    while build.written <= pos and not build.done and build.error is None:
+                        build.cond.wait()
+                    written = build.written
+                    if build.error is not None:
+                        raise RuntimeError(f"Archive build failed: {build.error}")
+                    if written <= pos:
+                        return
+                data = f.read(min(written - pos, ZipStream.chunk_size))
+                if not data:
+                    return
+                pos += len(data)
+                yield data
+# ------------------------------------
+
+
+# ---------- THUMBNAILS ----------
+THUMB_SIZE = 128                    # longest side in pixels, ~2.5x the listing icon
+THUMB_EXTENSIONS = IMAGE_EXTENSIONS - {'.svg'}
+THUMB_WORKERS = min(4, os.cpu_count() or 1)
+PREVIEW_CACHE_SUBDIR = "localshare-previews"
+PREVIEW_NAME = re.compile(r'[0-9a-f]{40}\.(?:jpg|png|json)\Z')   # sha1 key + suffix
+
+_pillow = None
+
+
+def load_pillow():
+    # Pillow is optional and only imported once thumbnails are wanted; without
+    # it the listing just keeps its icons
+    global _pillow
+    if _pillow is None:
+        try:
+            from PIL import Image, ImageOps
+            _pillow = (Image, ImageOps)
+        except ImportError:
+            _pillow = False
+    return _pillow or None
+
+
+def make_thumbnail(src, dst, size=THUMB_SIZE):
+    # Writes a JPEG (or a PNG for images with transparency) to dst and
+    # returns its suffix
+    Image, ImageOps = load_pillow()
+    with Image.open(src) as im:
+        # JPEGs decode straight at 1/2..1/8 scale, a big part of the cost
+        # for phone photos
+        im.draft('RGB', (size, size))
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((size, size))
+        if im.mode in ('RGBA', 'LA') or (im.mode == 'P' and 'transparency' in im.info):
+            im.convert('RGBA').save(dst, 'PNG', optimize=True)
+            return '.png'
+        im.convert('RGB').save(dst, 'JPEG', quality=80, optimize=True)
+        return '.jpg'
+
+
+class PreviewCache:
+    # Generated previews on disk in a shared DiskLRU, made on demand by a
+    # small pool so a folder full of media can't occupy every CPU; concurrent
+    # requests for the same key share one job
+    def __init__(self, store, workers, name):
+        self.store = store
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                          thread_name_prefix=name)
+        self._jobs = {}
+        self._requested = 0     # pool jobs some request is waiting for
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def source_key(*parts):
+        source = '\0'.join(str(part) for part in parts)
+        return hashlib.sha1(source.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def fetch(self, key, make, inline=False):
+        # Path of the cached file; make(temp_path) writes it and returns its
+        # suffix, and whatever it raises is raised here. inline runs it on the
+        # calling thread instead of the pool (the low-priority warm-up)
+        run = False
+        with self._lock:
+            cached = self.store.get(key)
+            if cached is not None:
+                return cached
+            job = self._jobs.get(key)
+            if job is None and inline:
+                job = self._jobs[key] = concurrent.futures.Future()
+                run = True
+            elif job is None:
+                self._requested += 1
+                job = self._jobs[key] = self.pool.submit(self._make, key, make, True)
+        if run:
+            try:
+                job.set_result(self._make(key, make))
+            except Exception as e:
+                job.set_exception(e)
+        return job.result()
+
+    def busy(self):
+        with self._lock:
+            return self._requested > 0
+
+    def _make(self, key, make, requested=False):
+        fd, temp_path = tempfile.mkstemp(dir=self.store.root, suffix='.tmp')
+        os.close(fd)
+        try:
+            path = self.store.path_for(key, make(temp_path))
+            os.replace(temp_path, path)
+            self.store.put(key, path)
+            return path
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            with self._lock:
+                del self._jobs[key]
+                if requested:
+                    self._requested -= 1
+
+
+class ThumbnailCache(PreviewCache):
+    # Image thumbnails keyed by source path, mtime and size
+    def __init__(self, store, workers=THUMB_WORKERS):
+        super().__init__(store, workers, "thumb")
+
+    def get(self, path, st, inline=False):
+        # Raises if the image can't be decoded
+        key = self.source_key('thumb', os.path.abspath(path), st.st_mtime_ns, st.st_size, THUMB_SIZE)
+        return self.fetch(key, functools.partial(make_thumbnail, path), inline)
+# ------------------------------------
+
+
+# ---------- VIDEO PREVIEWS ----------
+POSTER_WIDTH = 320
+SPRITE_TILE_WIDTH = 160
+SPRITE_TILE_HEIGHT = 90
+SPRITE_COLUMNS = 10
+SPRITE_MAX_FRAMES = 100
+SPRITE_MIN_INTERVAL = 2.0           # seconds between frames of short videos
+FFMPEG_TIMEOUT = 60
+VIDEO_PREVIEW_WORKERS = 2
+
+
+def probe_duration(ffmpeg, path):
+    # ffprobe doesn't always come with ffmpeg, but ffmpeg's own input
+    # summary has the duration ("Duration: N/A" for live-style streams)
+    result = subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-i', path],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT)
+    match = re.search(rb'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+    if match is None:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def grab_frame(ffmpeg, src, dst, at, vf):
+    # -ss before -i seeks the input to the nearest keyframe, so a frame late
+    # in a long file costs a few MB of reading, not a decode from the start
+    result = subprocess.run([ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+                             '-ss', f'{at:.3f}', '-i', src, '-frames:v', '1', '-vf', vf,
+                             '-q:v', '5', '-f', 'mjpeg', dst],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=FFMPEG_TIMEOUT)
+    return result.returncode == 0 and os.path.getsize(dst) > 0
+
+
+class VideoPreviews(PreviewCache):
+    # Poster frames and seek-preview sprite sheets (a grid of evenly spaced
+    # frames in one JPEG) made with a local ffmpeg
+    def __init__(self, store, ffmpeg, workers=VIDEO_PREVIEW_WORKERS):
+        super().__init__(store, workers, "video-preview")
+        self.ffmpeg = ffmpeg
+
+    def _key(self, kind, path, st):
+        return self.source_key(kind, os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    def info(self, path, st, inline=False):
+        # Duration and sprite layout; count is 0 when the duration is unknown
+        info_path = self.fetch(self._key('video-info', path, st),
+                               functools.partial(self._make_info, path), inline)
+        with open(info_path) as f:
+            return json.load(f)
+
+    def poster(self, path, st, inline=False):
+        info = self.info(path, st, inline)
+        return self.fetch(self._key('poster', path, st),
+                          functools.partial(self._make_poster, path, info), inline)
+
+    def sprite(self, path, st, inline=False):
+        info = self.info(path, st, inline)
+        if not info['count']:
+            raise ValueError("video duration unknown")
+        return self.fetch(self._key('sprite', path, st),
+                          functools.partial(self._make_sprite, path, info), inline)
+
+    def _make_info(self, path, dst):
+        duration = probe_duration(self.ffmpeg, path)
+        interval = count = 0
+        if duration:
+            interval = max(SPRITE_MIN_INTERVAL, duration / SPRITE_MAX_FRAMES)
+            count = max(1, min(SPRITE_MAX_FRAMES, int(duration // interval)))
+        with open(dst, 'w') as f:
+            json.dump({'duration': duration, 'interval': interval, 'count': count,
+                       'columns': max(1, min(SPRITE_COLUMNS, count)),
+                       'tile_width': SPRITE_TILE_WIDTH, 'tile_height': SPRITE_TILE_HEIGHT}, f)
+        return '.json'
+
+    def _make_poster(self, path, info, dst):
+        # A tenth of the way in skips black intros and studio logos
+        at = min(info['duration'] * 0.1, 60) if info['duration'] else 0
+        vf = f'scale={POSTER_WIDTH}:-2'
+        if not grab_frame(self.ffmpeg, path, dst, at, vf) and not (at and grab_frame(self.ffmpeg, path, dst, 0, vf)):
+            raise RuntimeError("ffmpeg could not decode a frame")
+        return '.jpg'
+
+    def _make_sprite(self, path, info, dst):
+        width, height = info['tile_width'], info['tile_height']
+        vf = (f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+              f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2')
+        frames_dir = tempfile.mkdtemp(prefix="localshare-frames-")
+        try:
+            previous = None
+            for i in range(info['count']):
+                frame = os.path.join(frames_dir, f'{i:03d}.jpg')
+                if not grab_frame(self.ffmpeg, path, frame, (i + 0.5) * info['interval'], vf):
+                    if previous is None:
+                        raise RuntimeError("ffmpeg could not decode a frame")
+                    shutil.copyfile(previous, frame)  # keep the grid positions
+                previous = frame
+            rows = -(-info['count'] // info['columns'])
+            result = subprocess.run([self.ffmpeg, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+                                     '-framerate', '1', '-i', os.path.join(frames_dir, '%03d.jpg'),
+                                     '-vf', f"tile={info['columns']}x{rows}", '-frames:v', '1',
+                                     '-q:v', '5', '-f', 'mjpeg', dst],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    timeout=FFMPEG_TIMEOUT)
+            if result.returncode != 0:
+                raise RuntimeError("ffmpeg could not tile the sprite sheet")
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+        return '.jpg'
+# ------------------------------------
+
+
+# ---------- BACKGROUND JOBS ----------
+JOB_HISTORY = 64
+JOB_SETTLE_DELAY = 0.5      # let the listing watcher see the new files first
+JOB_YIELD_WAIT = 0.2
+
+
+def lower_thread_priority():
+    # Best effort: Linux nice values are per thread; elsewhere the job queue
+    # only yields to foreground work
+    get_native_id = getattr(threading, 'get_native_id', None)
+    if get_native_id is None or not hasattr(os, 'setpriority') or not sys.platform.startswith('linux'):
+        return
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), 10)
+    except OSError:
+        pass
+
+
+class JobQueue:
+    # Warm-up work after uploads: batches of small tasks run in order on one
+    # low-priority thread, which steps aside while `busy()` reports that a
+    # request is waiting on the same resources. Recent batches keep their
+    # progress for /api/jobs.
+    def __init__(self, busy=None):
+        self.busy = busy
+        self.batches = collections.OrderedDict()
+        self.pending = collections.deque()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def submit(self, tasks, label=''):
+        batch = {'id': uuid.uuid4().hex[:12], 'label': label, 'state': 'queued',
+                 'total': len(tasks), 'done': 0, 'failed': 0,
+                 'created': time.time(), 'finished': None}
+        with self.cond:
+            self.batches[batch['id']] = batch
+            for old in list(self.batches.values())[:-JOB_HISTORY]:
+                if old['state'] == 'done':
+                    del self.batches[old['id']]
+            self.pending.append((batch, tasks))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="jobs", daemon=True)
+                self.thread.start()
+            self.cond.notify()
+        return batch['id']
+
+    def status(self, batch_id=None):
+        with self.cond:
+            if batch_id is not None:
+                batch = self.batches.get(batch_id)
+                return dict(batch) if batch is not None else None
+            return {'pending': sum(len(tasks) for _, tasks in self.pending),
+                    'batches': [dict(b) for b in reversed(self.batches.values())]}
+
+    def _run(self):
+        lower_thread_priority()
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                batch, tasks = self.pending.popleft()
+                batch['state'] = 'running'
+            delay = batch['created'] + JOB_SETTLE_DELAY - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            for task in tasks:
+                while self.busy is not None and self.busy():
+                    time.sleep(JOB_YIELD_WAIT)
+                try:
+                    task()
+                    outcome = 'done'
+                except Exception:
+                    outcome = 'failed'
+                with self.cond:
+                    batch[outcome] += 1
+            with self.cond:
+                batch['state'] = 'done'
+                batch['finished'] = time.time()
+# ------------------------------------
+
+
+# ---------- CHUNKED UPLOADS ----------
+# Partial files live inside the share so finalizing is a rename on the same
+# filesystem; the directory is hidden from listings, archives and URLs
+UPLOAD_PARTIAL_DIR = '.localshare-partial'
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_MAX = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 3600
+# Chunk PUTs writing at once: per upload, and across all clients. Requests
+# over either limit get a 429 and are retried by the browser
+UPLOAD_SESSION_WRITERS = 4
+UPLOAD_GLOBAL_WRITERS = 16
+upload_writers = threading.BoundedSemaphore(UPLOAD_GLOBAL_WRITERS)
+
+
+def preallocate(f, size):
+    # Reserve the space up front so a full disk fails at init, not at 90%
+    if hasattr(os, 'posix_fallocate') and size > 0:
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise
+    f.truncate(size)
+
+
+UPLOAD_BUFFER_SIZE = 1024 * 1024
+UPLOAD_FIELD_MAX = 64 * 1024
+_upload_buffers = threading.local()
+
+
+class UploadSession:
+    # One upload, multipart or chunked. Copy loops poll `cancelled` between
+    # buffers without taking any lock; `lock` only guards this upload's chunk
+    # bookkeeping, so concurrent uploads never contend with each other
+    def __init__(self, partial=None, size=0, target_dir=None, parts=None, hash_content=False):
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+        self.partial = partial
+        self.size = size
+        self.target_dir = target_dir
+        self.parts = parts
+        self.received = []
+        self.writers = 0
+        self.updated = time.time()
+        # With dedup on, chunked uploads hash the contiguous prefix received
+        # so far, so finalize only has to hash whatever came in last
+        self.hasher = hashlib.sha256() if hash_content else None
+        self.hashed = 0
+        self.hash_lock = threading.Lock()
+
+    def advance_hash(self, wait=False):
+        if not self.hash_lock.acquire(blocking=wait):
+            return  # another request thread is already on it
+        try:
+            while True:
+                with self.lock:
+                    ready = self.received[0][1] if self.received and self.received[0][0] == 0 else 0
+                if self.hashed >= ready:
+                    return
+                with open(self.partial, 'rb') as f:
+                    f.seek(self.hashed)
+                    while self.hashed < ready:
+                        data = f.read(min(UPLOAD_BUFFER_SIZE, ready - self.hashed))
+                        if not data:
+                            return
+                        self.hasher.update(data)
+                        self.hashed += len(data)
+        finally:
+            self.hash_lock.release()
+
+    @property
+    def chunked(self):
+        return self.partial is not None
+
+    def status(self):
+        with self.lock:
+            return {'size': self.size,
+                    'chunk_size': UPLOAD_CHUNK_SIZE,
+                    'parallel': UPLOAD_SESSION_WRITERS,
+                    'received': [list(r) for r in self.received],
+                    'missing': missing_ranges(self.received, self.size)}
+
+
+def upload_buffer():
+    # One buffer per request thread, reused for every upload it handles
+    buf = getattr(_upload_buffers, 'buf', None)
+    if buf is None:
+        buf = _upload_buffers.buf = bytearray(UPLOAD_BUFFER_SIZE)
+    return buf
+
+
+def read_into(stream, view):
+    readinto = getattr(stream, 'readinto', None)
+    if readinto is not None:
+        return readinto(view) or 0
+    data = stream.read(len(view))
+    view[:len(data)] = data
+    return len(data)
+
+
+class UploadCancelled(Exception):
+    pass
+
+
+class NameAllocator:
+    # Picks a free name.ext / name_1.ext / name_2.ext ... for each new file.
+    # The wanted name is tried directly; on a clash the directory is listed
+    # once and remembered, and a per-name counter continues from the last
+    # suffix handed out, so a folder of 20k index.html files costs O(1) per
+    # file. The chosen name is created with O_EXCL as a placeholder, which
+    # keeps concurrent uploads (and anything else writing there) apart
+    def __init__(self, max_dirs=256):
+        self.max_dirs = max_dirs
+        self._lock = threading.Lock()
+        self._dirs = collections.OrderedDict()  # dir -> {'names': set, 'next': {filename: n}}
+
+    def allocate(self, full_dir, filename):
+        path = os.path.join(full_dir, filename)
+        if self._create(path):
+            return path
+        name, ext = os.path.splitext(filename)
+        with self._lock:
+            state = self._dirs.get(full_dir)
+            if state is None:
+                state = {'names': set(os.listdir(full_dir)), 'next': {}}
+                self._dirs[full_dir] = state
+                while len(self._dirs) > self.max_dirs:
+                    self._dirs.popitem(last=False)
+            self._dirs.move_to_end(full_dir)
+            counter = state['next'].get(filename, 1)
+            while True:
+                candidate = f"{name}_{counter}{ext}"
+                counter += 1
+                if candidate in state['names']:
+                    continue
+                state['names'].add(candidate)
+                path = os.path.join(full_dir, candidate)
+                if self._create(path):
+                    state['next'][filename] = counter
+                    return path
+
+    def _create(self, path):
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            return True
+        except FileExistsError:
+            return False
+
+name_allocator = NameAllocator()
+
+
+def place_file(temp_path, full_dir, filename):
+    # Moves a finished temp file (on the share's filesystem) to a free name
+    # in full_dir and returns the final path
+    os.makedirs(full_dir, exist_ok=True)
+    save_path = name_allocator.allocate(full_dir, filename)
+    try:
+        try:
+            os.replace(temp_path, save_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # full_dir is a symlink or mount point on another filesystem
+            shutil.copyfile(temp_path, save_path)
+            os.remove(temp_path)
+    except OSError:
+        os.remove(save_path)  # our placeholder
+        raise
+    return save_path
+
+
+def write_at(fd, data, offset):
+    # Positional write: parallel chunk PUTs share no file position. Without
+    # pwrite (Windows), each request has its own descriptor, so a seek
+    # followed by write is just as safe
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            n = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+
+def add_range(ranges, start, end):
+    # ranges: sorted, non-overlapping [start, end) pairs; merges in place
+    i = bisect.bisect_left(ranges, [start, end])
+    if i > 0 and ranges[i - 1][1] >= start:
+        i -= 1
+        start = ranges[i][0]
+    j = i
+    while j < len(ranges) and ranges[j][0] <= end:
+        end = max(end, ranges[j][1])
+        j += 1
+    ranges[i:j] = [[start, end]]
+
+
+def missing_ranges(ranges, size):
+    missing = []
+    position = 0
+    for start, end in ranges:
+        if start > position:
+            missing.append([position, start])
+        position = max(position, end)
+    if position < size:
+        missing.append([position, size])
+    return missing
+
+
+def safe_relative_path(relative_path):
+    # Client-supplied "dir/sub/name.ext" -> sanitized components, or None
+    parts = [secure_filename(part) for part in relative_path.replace('\\', '/').split('/') if part]
+    if not parts or not all(parts):
+        return None
+    return parts
+
+# ------------------------------------
+
+
+# ---------- DEDUP ----------
+FICLONE = 0x40049409  # Linux ioctl: share extents with another file (btrfs, XFS, ...)
+
+
+def clone_file(src, dst):
+    # Creates dst with src's content: a reflink where the filesystem can,
+    # else a hardlink, else a plain copy. Returns which one it made
+    try:
+        import fcntl
+        with open(src, 'rb') as fsrc:
+            fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            try:
+                fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+                return 'reflink'
+            except OSError:
+                os.close(fd)
+                fd = None
+                os.remove(dst)
+            finally:
+                if fd is not None:
+                    os.close(fd)
+    except (ImportError, OSError):
+        pass
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        shutil.copyfile(src, dst)
+        return 'copy'
+
+
+class DedupIndex:
+    # sha256 -> files in the share known to hold that content. Entries are
+    # checked against size, mtime and inode before use, so files edited or
+    # deleted since are simply forgotten
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}   # digest -> {path: (size, mtime_ns, ino)}
+        self._sizes = {}   # size -> set of digests, for the cheap pre-check
+
+    def add(self, path, digest):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._files.setdefault(digest, {})[path] = (st.st_size, st.st_mtime_ns, st.st_ino)
+            self._sizes.setdefault(st.st_size, set()).add(digest)
+
+    def has_size(self, size):
+        with self._lock:
+            return bool(self._sizes.get(size))
+
+    def find(self, digest, size):
+        with self._lock:
+            candidates = list(self._files.get(digest, {}).items())
+        for path, signature in candidates:
+            try:
+                st = os.stat(path)
+                if (st.st_size, st.st_mtime_ns, st.st_ino) == signature and st.st_size == size:
+                    return path
+            except OSError:
+                pass
+            self._forget(digest, path)
+        return None
+
+    def _forget(self, digest, path):
+        with self._lock:
+            paths = self._files.get(digest, {})
+            signature = paths.pop(path, None)
+            if not paths:
+                self._files.pop(digest, None)
+                if signature is not None:
+                    self._sizes.get(signature[0], set()).discard(digest)
+
+    def settle(self, path, digest, scratch_dir):
+        # Called once a new file is complete: if the same content is already
+        # stored, swap the new copy for a clone of it so the space is shared
+        size = os.path.getsize(path)
+        existing = self.find(digest, size)
+        if existing is not None and existing != path:
+            temp = os.path.join(scratch_dir, 'dedup-' + uuid.uuid4().hex)
+            try:
+                if clone_file(existing, temp) == 'copy':
+                    os.remove(temp)  # no space to win on this filesystem
+                else:
+                    os.replace(temp, path)
+            except OSError:
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+        self.add(path, digest)
+
+# ------------------------------------
+
+
+def build_app(base_dir, allow_delete=False, pin=None, zip_compression='auto', zip_workers=None,
+              zip_cache_mb=1024, dedup=False, bandwidth=None, client_bandwidth=None,
+              thumb_cache_mb=256, thumb_cache_dir=None, ffmpeg=None):
+    global app, shared_dir, cache_dir
     shared_dir = base_dir
+    # Outside the share so generated files never show up in the listing
+    cache_dir = tempfile.mkdtemp(prefix="localshare-cache-")
     
     app = Flask(__name__)
     app.secret_key = os.urandom(24)
     app.config['BASE_DIR'] = base_dir
     app.config['ALLOW_DELETE'] = allow_delete
     app.config['PIN'] = pin
+    app.config['ZIP_COMPRESSION'] = zip_compression
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024
+    # Templates are compiled once here instead of being re-parsed by
+    # render_template_string on every request
+    app.jinja_loader = DictLoader({
+        'login.html': LOGIN_TEMPLATE,
+        'index.html': HTML_TEMPLATE,
+        'image_viewer.html': IMAGE_VIEWER_TEMPLATE,
+        'video_player.html': VIDEO_PLAYER_TEMPLATE,
+        'audio_player.html': AUDIO_PLAYER_TEMPLATE,
+    })
+    app.jinja_env.auto_reload = False
+    for template_name in app.jinja_loader.list_templates():
+        app.jinja_env.get_template(template_name)
+    
+    # Part of every generated validator, so nothing cached from an earlier
+    # run (with different files or settings) is ever considered current
+    instance_tag = uuid.uuid4().hex[:8]
+    
+    watcher = ListingWatcher(base_dir)
+    watcher.start()
+    
+    # Shared by all folder downloads; each archive keeps at most two blocks per
+    # worker in flight, and request threads only wait on results
+    zip_workers = zip_workers or os.cpu_count() or 1
+    zip_pool = None
+    if zip_workers > 1:
+        zip_pool = concurrent.futures.ThreadPoolExecutor(max_workers=zip_workers,
+                                                         thread_name_prefix="zip")
+    dedup_index = DedupIndex() if dedup else None
+    scheduler = BandwidthScheduler(bandwidth, client_bandwidth)
+    
+    archive_cache = None
+    if zip_cache_mb > 0:
+        archive_cache = ArchiveCache(os.path.join(cache_dir, "archives"), zip_cache_mb * 1024 * 1024)
+    
+    # Image thumbnails and video posters/sprites share one disk budget
+    thumbnails = None
+    video_previews = None
+    if thumb_cache_mb > 0:
+        # A dedicated subdirectory, so a --thumb-cache-dir that holds other
+        # files never has them counted, evicted or removed
+        preview_store = DiskLRU(os.path.join(thumb_cache_dir or cache_dir, PREVIEW_CACHE_SUBDIR),
+                                thumb_cache_mb * 1024 * 1024, owned=PREVIEW_NAME)
+        if load_pillow() is not None:
+            thumbnails = ThumbnailCache(preview_store)
+        if ffmpeg:
+            video_previews = VideoPreviews(preview_store, ffmpeg)
+    previewers = [cache for cache in (thumbnails, video_previews) if cache is not None]
+    
+    jobs = JobQueue(busy=lambda: any(cache.busy() for cache in previewers))
+    
+    def warm_listings(dirs):
+        # Listings (with directory sizes) of every folder that shows the new files
+        for dir_path in dirs:
+            watcher.snapshot(dir_path)
+    
+    def warm_thumbnail(path):
+        thumbnails.get(path, os.stat(path), inline=True)
+    
+    def warm_video(path):
+        st = os.stat(path)
+        video_previews.poster(path, st, inline=True)
+        if video_previews.info(path, st, inline=True)['count']:
+            video_previews.sprite(path, st, inline=True)
+    
+    def prewarm(saved_paths):
+        # Queue what the first visitor would otherwise pay for: the listings,
+        # then previews, then the listings again in case the folder changed
+        # meanwhile (cheap when it didn't)
+        saved_paths = [os.path.abspath(path) for path in saved_paths]
+        dirs = set()
+        for path in saved_paths:
+            dir_path = os.path.dirname(path)
+            while dir_path not in dirs:
+                dirs.add(dir_path)
+                if os.path.normcase(dir_path) == os.path.normcase(os.path.abspath(base_dir)):
+                    break
+                parent = os.path.dirname(dir_path)
+                if parent == dir_path:
+                    break
+                dir_path = parent
+        dirs = sorted(dirs)
+        tasks = [functools.partial(warm_listings, dirs)]
+        if thumbnails is not None:
+            tasks += [functools.partial(warm_thumbnail, path) for path in saved_paths
+                      if os.path.splitext(path)[1].lower() in THUMB_EXTENSIONS]
+        if video_previews is not None:
+            tasks += [functools.partial(warm_video, path) for path in saved_paths
+                      if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS]
+        tasks.append(functools.partial(warm_listings, dirs))
+        label = os.path.basename(saved_paths[0]) if len(saved_paths) == 1 else f'{len(saved_paths)} files'
+        return jobs.submit(tasks, label)
     
     def check_auth():
         if app.config['PIN']:
             return session.get('authenticated') == True
         return True
     
+    def share_path(filename):
+        # URL paths come from the client; never let one escape the share or
+        # reach into the partial uploads
+        full_path = safe_join(base_dir, filename)
+        if full_path is None or os.path.relpath(full_path, base_dir).split(os.sep)[0] == UPLOAD_PARTIAL_DIR:
+            return None
+        return full_path
+    
+    def upload_dir(dir_relpath):
+        dir_path = share_path(dir_relpath)
+        if dir_path is None or not os.path.isdir(dir_path):
+            return None
+        return dir_path
+    
+    def resolve_path(filename):
+        full_path = share_path(filename)
+        if full_path is None or not os.path.exists(full_path):
+            abort(404)
+        return full_path
+    
+    def throttle(priority):
+        return scheduler.throttle(request.remote_addr, priority)
+    
     @app.route('/login', methods=['GET', 'POST'])
     def login():
         if not app.config['PIN']:
@@ -184,9 +2119,9 @@ def build_app(base_dir, allow_delete=False, pin=None):
                 session['authenticated'] = True
                 return redirect(url_for('index'))
             else:
-                return render_template_string(LOGIN_TEMPLATE, error=True)
+                return render_template('login.html', error=True)
         
-        return render_template_string(LOGIN_TEMPLATE, error=False)
+        return render_template('login.html', error=False)
     
     @app.route('/logout')
     def logout():
@@ -204,277 +2139,618 @@ def build_app(base_dir, allow_delete=False, pin=None):
     def stats():
         if not check_auth():
             return jsonify({'error': 'Unauthorized'}), 403
-        return jsonify({'connected_users': len(connected_ips)})
+        return jsonify({'connected_users': len(connected_ips),
+                        'listing_generation': watcher.generation})
+    
+    def render_index(dir_relpath):
+        # The rows are fetched page by page from /api/list
+        generation = watcher.snapshot(os.path.join(base_dir, dir_relpath))[1]
+        etag = f'{instance_tag}-{generation}'
+        rv = not_modified(etag, weak=True)
+        if rv is None:
+            crumbs = []
+            parts = [part for part in dir_relpath.split('/') if part]
+            for i, part in enumerate(parts):
+                crumbs.append({'name': part, 'path': '/'.join(parts[:i + 1])})
+            rv = make_response(render_template('index.html', 
+                                       generation=generation,
+                                       current_path='/'.join(parts),
+                                       breadcrumbs=crumbs,
+                                       upload_chunk_size=UPLOAD_CHUNK_SIZE,
+                                       dedup=dedup_index is not None,
+                                       thumb_extensions=sorted(THUMB_EXTENSIONS) if thumbnails else [],
+                                       video_posters=video_previews is not None,
+                                       allow_delete=allow_delete,
+                                       pin_required=pin is not None))
+            add_validators(rv, etag, weak=True)
+        rv.headers['X-Listing-Generation'] = str(generation)
+        return rv
     
     @app.route('/')
     def index():
         if not check_auth():
             return redirect(url_for('login'))
-            
-        files = []
-        for item in os.listdir(base_dir):
-            full_path = os.path.join(base_dir, item)
-            files.append(FileInfo(full_path, base_dir))
-        files.sort(key=lambda x: x.mtime, reverse=True)
+        return render_index('')
+    
+    @app.route('/browse/<path:subpath>')
+    def browse(subpath):
+        if not check_auth():
+            return redirect(url_for('login'))
         
-        return render_template_string(HTML_TEMPLATE, 
-                                   files=files, 
-                                   allow_delete=allow_delete,
-                                   pin_required=pin is not None)
+        full_path = resolve_path(subpath)
+        if not os.path.isdir(full_path):
+            return redirect(url_for('files', filename=subpath))
+        relpath = os.path.relpath(full_path, base_dir).replace(os.sep, '/')
+        if relpath == '.':
+            return redirect(url_for('index'))
+        return render_index(relpath)
+
+    @app.route('/api/list')
+    def api_list():
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        sort = request.args.get('sort', 'mtime')
+        order = request.args.get('order', 'asc' if sort == 'name' else 'desc')
+        kind = request.args.get('type') or None
+        if sort not in LISTING_SORT_KEYS or order not in ('asc', 'desc'):
+            return jsonify({'error': 'Invalid sort'}), 400
+        if kind is not None and kind not in LISTING_TYPES:
+            return jsonify({'error': 'Invalid type'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', 100)), 1), LISTING_PAGE_MAX)
+            cursor = request.args.get('cursor')
+            after = decode_cursor(cursor, sort) if cursor else None
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor or limit'}), 400
+        
+        dir_path = resolve_path(request.args.get('path', ''))
+        if not os.path.isdir(dir_path):
+            return jsonify({'error': 'Not a directory'}), 400
+        
+        (entries, keys), generation = watcher.view(sort, kind, dir_path)
+        etag = f'{instance_tag}-{generation}'
+        rv = not_modified(etag, weak=True)
+        if rv is not None:
+            return rv
+        
+        page, has_more = page_listing(entries, keys, after, limit, order == 'desc')
+        next_cursor = encode_cursor(LISTING_SORT_KEYS[sort](page[-1])) if page and has_more else None
+        rv = jsonify({'entries': [f.to_json() for f in page],
+                      'next_cursor': next_cursor,
+                      'total': len(entries),
+                      'generation': generation})
+        return add_validators(rv, etag, weak=True)
 
     @app.route('/files/<path:filename>')
     def files(filename):
         if not check_auth():
             return redirect(url_for('login'))
             
-        full_path = os.path.join(base_dir, filename)
-        if not os.path.exists(full_path):
-            abort(404)
+        full_path = resolve_path(filename)
             
         if os.path.isdir(full_path):
-            memory_file = io.BytesIO()
-            with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for root, dirs, files_list in os.walk(full_path):
-                    for file in files_list:
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, full_path)
-                        zf.write(file_path, arcname)
-            memory_file.seek(0)
-            return send_file(memory_file, 
-                           download_name=f"{filename}.zip",
-                           as_attachment=True,
-                           mimetype='application/zip')
-        
-        return send_file(full_path, as_attachment=True)
+            compression = request.args.get('compression', app.config['ZIP_COMPRESSION'])
+            if compression not in ZIP_COMPRESSION_MODES:
+                return f"Unknown compression mode: {compression}", 400
+            
+            def make_chunks():
+                return stream_zip_directory(full_path, compression, zip_pool, 2 * zip_workers)
+            
+            archive_name = os.path.basename(os.path.normpath(full_path)) + ".zip"
+            
+            # Archive bytes depend on the subtree and on this process' settings
+            key, bound = tree_fingerprint(full_path, compression)
+            etag = f'{key}-{instance_tag}'
+            rv = not_modified(etag)
+            if rv is not None:
+                return rv
+            if archive_cache is None:
+                chunks = make_chunks()
+            else:
+                cached, chunks = archive_cache.open(key, bound, make_chunks)
+                if cached is not None:
+                    return serve_file(cached, mimetype='application/zip', as_attachment=True,
+                                      download_name=archive_name, etag=etag,
+                                      throttle=throttle(PRIORITY_BULK))
+            bulk = throttle(PRIORITY_BULK)
+            if bulk is not None:
+                chunks = Throttled(chunks, bulk)
+            # Stream the archive as it is built; the size isn't known up front
+            rv = Response(chunks, mimetype='application/zip', direct_passthrough=True)
+            add_validators(rv, etag)
+            return set_attachment(rv, archive_name)
+        
+        return serve_file(full_path, as_attachment=True, throttle=throttle(PRIORITY_BULK))
     
     @app.route('/stream/<path:filename>')
     def stream(filename):
         if not check_auth():
             return redirect(url_for('login'))
             
-        full_path = os.path.join(base_dir, filename)
-        if not os.path.exists(full_path):
-            abort(404)
+        full_path = resolve_path(filename)
         
         ext = os.path.splitext(filename)[1].lower()
+        if ext not in IMAGE_EXTENSIONS and ext not in VIDEO_EXTENSIONS and ext not in AUDIO_EXTENSIONS:
+            return "File type not supported for streaming", 400
+        
+        # The video page lists the subtitles next to the video, hence the
+        # generation of that directory's listing
+        video_dir = os.path.dirname(full_path)
+        listing, generation = watcher.snapshot(video_dir)
+        etag = f'{instance_tag}-{generation}-{file_etag(os.stat(full_path))}'
+        rv = not_modified(etag, weak=True)
+        if rv is not None:
+            return rv
         
-        if ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.ico']:
-            return render_template_string(IMAGE_VIEWER_TEMPLATE, 
+        if ext in IMAGE_EXTENSIONS:
+            page = render_template('image_viewer.html', 
                                          filename=filename,
                                          file_url=url_for('view_file', filename=filename))
         
-        elif ext in ['.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v']:
-            subtitles = []
-            for item in os.listdir(base_dir):
-                if item.lower().endswith(('.vtt', '.srt')):
-                    subtitles.append(item)
-            subtitles.sort()
+        elif ext in VIDEO_EXTENSIONS:
+            subtitles = sorted(f.relpath.replace(os.sep, '/') for f in listing
+                               if f.is_subtitle)
             
-            return render_template_string(VIDEO_PLAYER_TEMPLATE, 
+            page = render_template('video_player.html', 
                                          filename=filename,
                                          file_url=url_for('view_file', filename=filename),
-                                         subtitles=subtitles)
+                                         subtitles=subtitles,
+                                         poster_url=url_for('poster', filename=filename)
+                                                    if video_previews else None,
+                                         previews_url=url_for('api_previews', filename=filename)
+                                                      if video_previews else None)
         
-        elif ext in ['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma', '.opus']:
-            return render_template_string(AUDIO_PLAYER_TEMPLATE, 
+        else:
+            page = render_template('audio_player.html', 
                                          filename=filename,
                                          file_url=url_for('view_file', filename=filename))
         
-        else:
-            return "File type not supported for streaming", 400
+        return add_validators(make_response(page), etag, weak=True)
     
     @app.route('/view/<path:filename>')
     def view_file(filename):
         if not check_auth():
             return redirect(url_for('login'))
             
-        full_path = os.path.join(base_dir, filename)
-        if not os.path.exists(full_path):
-            abort(404)
+        full_path = resolve_path(filename)
         
-        # Check if it's a media file that requires range support (streaming)
-        ext = os.path.splitext(filename)[1].lower()
-        is_media = ext in ['.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v',
-                           '.mp3', '.wav', '.m4a', '.flac', '.aac', '.wma', '.opus']
+        # Media players seek (and read MP4 moov atoms at the end) with range
+        # requests; serve_file answers them for every file type. Playback
+        # stalls are what users notice, so it goes ahead of bulk traffic
+        return serve_file(full_path, throttle=throttle(PRIORITY_INTERACTIVE))
 
-        if is_media:
-            file_size = os.path.getsize(full_path)
-            range_header = request.headers.get('Range', None)
-            
-            # Get the appropriate MIME type
-            mime_type = mimetypes.guess_type(full_path)[0]
-            if not mime_type:
-                mime_type = 'application/octet-stream'
-            
-            if not range_header:
-                # No range request - send whole file with proper headers for streaming
-                def generate():
-                    with open(full_path, 'rb') as f:
-                        while True:
-                            chunk = f.read(8192)  # 8KB chunks
-                            if not chunk:
-                                break
-                            yield chunk
-                
-                rv = Response(generate(), 200, mimetype=mime_type, direct_passthrough=True)
-                rv.headers.add('Content-Length', str(file_size))
-                rv.headers.add('Accept-Ranges', 'bytes')
-                return rv
-            
-            # Parse the Range header (e.g., "bytes=0-", "bytes=1024-2048")
-            m = re.search(r'bytes=(\d+)-(\d*)', range_header)
-            if not m:
-                abort(416)  # Range Not Satisfiable
-                
-            g = m.groups()
-            byte_start = int(g[0])
-            byte_end = int(g[1]) if g[1] else file_size - 1
-            
-            # Validate range
-            if byte_start >= file_size or byte_end >= file_size or byte_start > byte_end:
-                abort(416)
-            
-            length = byte_end - byte_start + 1
-            
-            # Read and send the requested range
-            def generate_range():
-                with open(full_path, 'rb') as f:
-                    f.seek(byte_start)
-                    remaining = length
-                    while remaining > 0:
-                        chunk_size = min(8192, remaining)  # 8KB chunks
-                        chunk = f.read(chunk_size)
-                        if not chunk:
-                            break
-                        remaining -= len(chunk)
-                        yield chunk
-            
-            # Construct Partial Content Response (206)
-            rv = Response(generate_range(), 206, mimetype=mime_type, direct_passthrough=True)
-            rv.headers.add('Content-Range', f'bytes {byte_start}-{byte_end}/{file_size}')
-            rv.headers.add('Accept-Ranges', 'bytes')
-            rv.headers.add('Content-Length', str(length))
+    def preview_source(filename, cache, extensions):
+        # The file a preview is made from, or 404
+        if cache is None:
+            abort(404)
+        full_path = resolve_path(filename)
+        if os.path.splitext(full_path)[1].lower() not in extensions or os.path.isdir(full_path):
+            abort(404)
+        return full_path, os.stat(full_path)
+    
+    def serve_preview(make, etag):
+        rv = not_modified(etag)
+        if rv is not None:
             return rv
-
-        # For images/other files, standard send is fine
-        return send_file(full_path)
+        try:
+            preview_path = make()
+        except Exception:
+            return "Preview could not be generated", 415
+        rv = serve_file(preview_path, etag=etag, throttle=throttle(PRIORITY_INTERACTIVE))
+        if request.args.get('v'):
+            # Listing URLs carry the source's mtime and size, so a cached
+            # copy never needs revalidating
+            rv.headers['Cache-Control'] = 'max-age=31536000, immutable'
+        return rv
+    
+    @app.route('/thumb/<path:filename>')
+    def thumbnail(filename):
+        if not check_auth():
+            return redirect(url_for('login'))
+        full_path, st = preview_source(filename, thumbnails, THUMB_EXTENSIONS)
+        return serve_preview(lambda: thumbnails.get(full_path, st), f'thumb-{THUMB_SIZE}-{file_etag(st)}')
+    
+    @app.route('/poster/<path:filename>')
+    def poster(filename):
+        if not check_auth():
+            return redirect(url_for('login'))
+        full_path, st = preview_source(filename, video_previews, VIDEO_EXTENSIONS)
+        return serve_preview(lambda: video_previews.poster(full_path, st), f'poster-{file_etag(st)}')
+    
+    @app.route('/sprites/<path:filename>')
+    def sprites(filename):
+        if not check_auth():
+            return redirect(url_for('login'))
+        full_path, st = preview_source(filename, video_previews, VIDEO_EXTENSIONS)
+        return serve_preview(lambda: video_previews.sprite(full_path, st), f'sprite-{file_etag(st)}')
+    
+    @app.route('/api/previews/<path:filename>')
+    def api_previews(filename):
+        # Sprite sheet layout for the player's seek preview
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        full_path, st = preview_source(filename, video_previews, VIDEO_EXTENSIONS)
+        try:
+            info = video_previews.info(full_path, st)
+        except Exception:
+            return jsonify({'error': 'Video could not be read'}), 415
+        version = f'{st.st_mtime_ns}-{st.st_size}'
+        info['poster'] = url_for('poster', filename=filename, v=version)
+        info['sprite'] = url_for('sprites', filename=filename, v=version) if info['count'] else None
+        return jsonify(info)
 
     @app.route('/upload', methods=['POST'])
     def upload_file():
         if not check_auth():
             return jsonify({'error': 'Unauthorized'}), 403
         
-        # Generate unique session ID for this upload
-        session_id = request.headers.get('X-Upload-Session-ID')
-        if not session_id:
-            return jsonify({'error': 'No session ID provided'}), 400
+        # Generate unique session ID for this upload
+        session_id = request.headers.get('X-Upload-Session-ID')
+        if not session_id:
+            return jsonify({'error': 'No session ID provided'}), 400
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({'error': 'Expected multipart/form-data'}), 400
+        
+        # Check if upload was cancelled
+        upload = UploadSession()
+        with upload_lock:
+            existing = upload_sessions.get(session_id)
+            if existing is not None and existing.cancelled.is_set():
+                return jsonify({'error': 'Upload cancelled'}), 499
+            upload_sessions[session_id] = upload
+        
+        # The body is parsed as it arrives rather than through request.files,
+        # so each file part is written once, straight into a temp file next
+        # to its destination, and renamed into place when the part ends.
+        # Fields have to precede the files they describe: "dir" first, then
+        # "path_<n>" before the n-th file part
+        decoder = multipart.MultipartDecoder(boundary.encode('latin-1'))
+        form = {}
+        field = None        # [name, value] while a form field streams in
+        part = None         # [file, temp path, relative path, hasher] while a file streams in
+        file_index = 0
+        uploaded_files = []
+        saved_paths = []
+        completed = False
+        partial_dir = os.path.join(base_dir, UPLOAD_PARTIAL_DIR)
+        buf = upload_buffer()
+        pace = throttle(PRIORITY_UPLOAD)
+        
+        def discard_part():
+            if part is not None:
+                part[0].close()
+                try:
+                    os.remove(part[1])
+                except OSError:
+                    pass
+        
+        try:
+            while True:
+                event = decoder.next_event()
+                if isinstance(event, multipart.NeedData):
+                    # Cancellation lands between buffers, even mid-file
+                    if upload.cancelled.is_set():
+                        raise UploadCancelled()
+                    n = read_into(request.stream, buf)
+                    if pace is not None and n:
+                        pace.wait(n)
+                    decoder.receive_data(memoryview(buf)[:n] if n else None)
+                elif isinstance(event, multipart.Field):
+                    field = [event.name, bytearray()]
+                elif isinstance(event, multipart.File):
+                    relative_path = form.get(f'path_{file_index}') or event.filename
+                    file_index += 1
+                    if safe_relative_path(relative_path or '') is None:
+                        part = None  # e.g. an empty file input; skip its data
+                        continue
+                    os.makedirs(partial_dir, exist_ok=True)
+                    fd, temp_path = tempfile.mkstemp(dir=partial_dir, prefix='part-')
+                    hasher = hashlib.sha256() if dedup_index is not None else None
+                    part = [os.fdopen(fd, 'wb'), temp_path, relative_path, hasher]
+                elif isinstance(event, multipart.Data):
+                    if part is not None:
+                        part[0].write(event.data)
+                        if part[3] is not None:
+                            part[3].update(event.data)
+                    elif field is not None:
+                        field[1] += event.data
+                        if len(field[1]) > UPLOAD_FIELD_MAX:
+                            return jsonify({'error': 'Form field too large'}), 413
+                    if event.more_data:
+                        continue
+                    if part is not None:
+                        part[0].close()
+                        upload_root = upload_dir(form.get('dir', ''))
+                        if upload_root is None:
+                            return jsonify({'error': 'Target directory not found'}), 404
+                        parts = safe_relative_path(part[2])
+                        save_path = place_file(part[1], os.path.join(upload_root, *parts[:-1]), parts[-1])
+                        hasher = part[3]
+                        part = None
+                        saved_paths.append(save_path)
+                        if hasher is not None:
+                            dedup_index.settle(save_path, hasher.hexdigest(), partial_dir)
+                        uploaded_files.append(os.path.basename(save_path))
+                        watcher.invalidate(save_path)
+                    elif field is not None:
+                        form[field[0]] = field[1].decode('utf-8', 'replace')
+                        field = None
+                elif isinstance(event, multipart.Epilogue):
+                    break
+            
+            if not file_index:
+                return jsonify({'error': 'No files provided'}), 400
+            completed = True
+            job_id = prewarm(saved_paths) if saved_paths else None
+            return jsonify({'success': True, 'files': uploaded_files, 'job': job_id})
+        
+        except UploadCancelled:
+            return jsonify({'error': 'Upload cancelled'}), 499
+        
+        except (ClientDisconnected, ValueError) as e:
+            return jsonify({'error': f'Malformed or truncated upload: {e}'}), 400
+        
+        except HTTPException:
+            raise  # e.g. 413 for a body over MAX_CONTENT_LENGTH
+        
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+        
+        finally:
+            discard_part()
+            with upload_lock:
+                if upload_sessions.get(session_id) is upload:
+                    del upload_sessions[session_id]
+            # A failed or cancelled batch leaves nothing behind
+            if not completed:
+                for saved_path in saved_paths:
+                    try:
+                        os.remove(saved_path)
+                        watcher.invalidate(saved_path)
+                    except OSError:
+                        pass
+
+    def upload_status_json(session_id, upload):
+        status = upload.status()
+        status['session_id'] = session_id
+        return jsonify(status)
+    
+    def discard_upload(session_id):
+        # Caller holds upload_lock
+        upload = upload_sessions.pop(session_id, None)
+        if upload is not None and upload.chunked:
+            try:
+                os.remove(upload.partial)
+            except OSError:
+                pass
+    
+    def too_large(size):
+        # Chunked uploads are many small requests, so the server's upload cap
+        # is checked against the declared file size instead
+        limit = app.config['MAX_CONTENT_LENGTH']
+        return limit is not None and size > limit
+    
+    def chunked_upload(session_id):
+        with upload_lock:
+            upload = upload_sessions.get(session_id)
+        if upload is None or not upload.chunked:
+            return None
+        upload.updated = time.time()
+        return upload
+    
+    @app.route('/upload/init', methods=['POST'])
+    def upload_init():
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        parts = safe_relative_path(str(data.get('path', '')))
+        size = data.get('size')
+        target_dir = upload_dir(str(data.get('dir', '')))
+        if parts is None or not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            return jsonify({'error': 'Invalid path or size'}), 400
+        if too_large(size):
+            return jsonify({'error': 'File too large'}), 413
+        if target_dir is None:
+            return jsonify({'error': 'Target directory not found'}), 404
+        
+        now = time.time()
+        with upload_lock:
+            for stale_id in [sid for sid, upload in upload_sessions.items()
+                             if upload.chunked and now - upload.updated > UPLOAD_SESSION_TTL]:
+                discard_upload(stale_id)
+        
+        session_id = uuid.uuid4().hex
+        partial_dir = os.path.join(base_dir, UPLOAD_PARTIAL_DIR)
+        os.makedirs(partial_dir, exist_ok=True)
+        partial = os.path.join(partial_dir, session_id)
+        try:
+            with open(partial, 'wb') as f:
+                preallocate(f, size)
+        except OSError as e:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            if e.errno == errno.ENOSPC:
+                return jsonify({'error': 'Not enough disk space'}), 507
+            return jsonify({'error': str(e)}), 500
+        
+        upload = UploadSession(partial, size, target_dir, parts, hash_content=dedup_index is not None)
+        with upload_lock:
+            upload_sessions[session_id] = upload
+        return upload_status_json(session_id, upload)
+    
+    @app.route('/upload/check', methods=['POST'])
+    def upload_check():
+        # Dedup pre-check. With just a size it says whether hashing the file
+        # is worth it; with a sha256 too, a known file is materialised at
+        # its destination right away and nothing has to be sent
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        if dedup_index is None:
+            return jsonify({'error': 'Deduplication is disabled'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        size = data.get('size')
+        if not isinstance(size, int) or isinstance(size, bool) or size < 0:
+            return jsonify({'error': 'Invalid size'}), 400
+        digest = data.get('sha256')
+        if digest is None:
+            return jsonify({'known_size': dedup_index.has_size(size)})
+        
+        parts = safe_relative_path(str(data.get('path', '')))
+        target_dir = upload_dir(str(data.get('dir', '')))
+        if parts is None or not isinstance(digest, str):
+            return jsonify({'error': 'Invalid path or digest'}), 400
+        if target_dir is None:
+            return jsonify({'error': 'Target directory not found'}), 404
+        existing = dedup_index.find(digest.lower(), size)
+        if existing is None:
+            return jsonify({'exists': False})
+        
+        partial_dir = os.path.join(base_dir, UPLOAD_PARTIAL_DIR)
+        os.makedirs(partial_dir, exist_ok=True)
+        temp = os.path.join(partial_dir, 'dedup-' + uuid.uuid4().hex)
+        full_dir = os.path.join(target_dir, *parts[:-1])
+        try:
+            clone_file(existing, temp)
+            save_path = place_file(temp, full_dir, parts[-1])
+        except OSError as e:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return jsonify({'error': str(e)}), 500
+        dedup_index.add(save_path, digest.lower())
+        watcher.invalidate(save_path)
+        return jsonify({'exists': True, 'files': [os.path.basename(save_path)]})
+    
+    @app.route('/upload/<session_id>', methods=['GET'])
+    def upload_status(session_id):
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        upload = chunked_upload(session_id)
+        if upload is None:
+            return jsonify({'error': 'Session not found'}), 404
+        return upload_status_json(session_id, upload)
+    
+    @app.route('/upload/<session_id>', methods=['PUT'])
+    def upload_chunk(session_id):
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        upload = chunked_upload(session_id)
+        if upload is None:
+            return jsonify({'error': 'Session not found'}), 404
+        if too_large(upload.size):
+            return jsonify({'error': 'File too large'}), 413
+        try:
+            offset = int(request.args.get('offset', ''))
+        except ValueError:
+            return jsonify({'error': 'Invalid offset'}), 400
+        length = request.content_length
+        if length is None or length > UPLOAD_CHUNK_MAX:
+            return jsonify({'error': 'Chunk needs a Content-Length of at most %d' % UPLOAD_CHUNK_MAX}), 411
+        if offset < 0 or offset + length > upload.size:
+            return jsonify({'error': 'Chunk outside the file'}), 416
         
-        # Check if upload was cancelled
-        with upload_lock:
-            if session_id in upload_sessions and upload_sessions[session_id].get('cancelled'):
-                return jsonify({'error': 'Upload cancelled'}), 499
-            upload_sessions[session_id] = {'cancelled': False, 'temp_files': []}
+        with upload.lock:
+            busy = upload.writers >= UPLOAD_SESSION_WRITERS
+            if not busy:
+                upload.writers += 1
+        if busy or not upload_writers.acquire(blocking=False):
+            if not busy:
+                with upload.lock:
+                    upload.writers -= 1
+            rv = jsonify({'error': 'Too many chunks in flight'})
+            rv.headers['Retry-After'] = '1'
+            return rv, 429
         
-        files = request.files.getlist('file')
-        if not files:
-            return jsonify({'error': 'No files provided'}), 400
+        written = 0
+        fd = None
+        buf = upload_buffer()
+        pace = throttle(PRIORITY_UPLOAD)
+        try:
+            fd = os.open(upload.partial, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+            while written < length:
+                if upload.cancelled.is_set():
+                    return jsonify({'error': 'Upload cancelled'}), 499
+                n = read_into(request.stream, memoryview(buf)[:min(len(buf), length - written)])
+                if not n:
+                    break
+                if pace is not None:
+                    pace.wait(n)
+                write_at(fd, memoryview(buf)[:n], offset + written)
+                written += n
+        except OSError as e:
+            return jsonify({'error': str(e)}), 500
+        except ClientDisconnected:
+            pass  # keep what arrived
+        finally:
+            if fd is not None:
+                os.close(fd)
+            upload_writers.release()
+            # Whatever made it to disk counts, so a retry only resends the rest
+            with upload.lock:
+                upload.writers -= 1
+                if written:
+                    add_range(upload.received, offset, offset + written)
         
-        uploaded_files = []
-        temp_files = []
+        if written < length:
+            return jsonify({'error': 'Incomplete chunk'}), 400
+        if upload.hasher is not None:
+            upload.advance_hash()
+        return upload_status_json(session_id, upload)
+    
+    @app.route('/upload/<session_id>/finalize', methods=['POST'])
+    def upload_finalize(session_id):
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        with upload_lock:
+            upload = upload_sessions.get(session_id)
+            if upload is None or not upload.chunked:
+                return jsonify({'error': 'Session not found'}), 404
+            with upload.lock:
+                incomplete = bool(missing_ranges(upload.received, upload.size))
+            if incomplete:
+                return upload_status_json(session_id, upload), 409
+            del upload_sessions[session_id]
         
+        parts = upload.parts
+        full_dir = os.path.join(upload.target_dir, *parts[:-1])
         try:
-            for file in files:
-                # Check cancellation status
-                with upload_lock:
-                    if upload_sessions[session_id]['cancelled']:
-                        # Clean up any temp files created so far
-                        for temp_file in temp_files:
-                            try:
-                                if os.path.exists(temp_file):
-                                    os.remove(temp_file)
-                            except:
-                                pass
-                        return jsonify({'error': 'Upload cancelled'}), 499
-                
-                if file.filename == '':
-                    continue
-                    
-                relative_path = request.form.get(f'path_{files.index(file)}', '')
-                if not relative_path:
-                    relative_path = file.filename
-                
-                filename = secure_filename(os.path.basename(relative_path))
-                
-                dir_path = os.path.dirname(relative_path)
-                if dir_path:
-                    full_dir = os.path.join(base_dir, secure_filename(dir_path))
-                    os.makedirs(full_dir, exist_ok=True)
-                    save_path = os.path.join(full_dir, filename)
-                else:
-                    save_path = os.path.join(base_dir, filename)
-                
-                counter = 1
-                name, ext = os.path.splitext(filename)
-                while os.path.exists(save_path):
-                    filename = f"{name}_{counter}{ext}"
-                    if dir_path:
-                        full_dir = os.path.join(base_dir, secure_filename(dir_path))
-                        save_path = os.path.join(full_dir, filename)
-                    else:
-                        save_path = os.path.join(base_dir, filename)
-                    counter += 1
-                
-                # Save file in chunks to allow cancellation
-                chunk_size = 8192
-                with open(save_path, 'wb') as f:
-                    while True:
-                        # Check cancellation before each chunk
-                        with upload_lock:
-                            if upload_sessions[session_id]['cancelled']:
-                                f.close()
-                                # Clean up partial file
-                                try:
-                                    os.remove(save_path)
-                                except:
-                                    pass
-                                # Clean up other temp files
-                                for temp_file in temp_files:
-                                    try:
-                                        if os.path.exists(temp_file):
-                                            os.remove(temp_file)
-                                    except:
-                                        pass
-                                return jsonify({'error': 'Upload cancelled'}), 499
-                        
-                        chunk = file.stream.read(chunk_size)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                
-                temp_files.append(save_path)
-                uploaded_files.append(filename)
-            
-            # Upload completed successfully
-            with upload_lock:
-                if session_id in upload_sessions:
-                    del upload_sessions[session_id]
-            
-            return jsonify({'success': True, 'files': uploaded_files})
-            
-        except Exception as e:
-            # Clean up on error
-            for temp_file in temp_files:
-                try:
-                    if os.path.exists(temp_file):
-                        os.remove(temp_file)
-                except:
-                    pass
-            
+            if upload.hasher is not None:
+                upload.advance_hash(wait=True)
+            save_path = place_file(upload.partial, full_dir, parts[-1])
+        except OSError as e:
             with upload_lock:
-                if session_id in upload_sessions:
-                    del upload_sessions[session_id]
-            
+                upload_sessions[session_id] = upload  # still resumable
             return jsonify({'error': str(e)}), 500
+        if upload.hasher is not None:
+            dedup_index.settle(save_path, upload.hasher.hexdigest(), os.path.dirname(upload.partial))
+        watcher.invalidate(save_path)
+        return jsonify({'success': True, 'files': [os.path.basename(save_path)],
+                        'job': prewarm([save_path])})
+
+    @app.route('/api/jobs')
+    def api_jobs():
+        # Progress of the background work queued after uploads
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        return jsonify(jobs.status())
+    
+    @app.route('/api/jobs/<job_id>')
+    def api_job(job_id):
+        if not check_auth():
+            return jsonify({'error': 'Unauthorized'}), 403
+        status = jobs.status(job_id)
+        if status is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(status)
 
     @app.route('/cancel-upload', methods=['POST'])
     def cancel_upload():
@@ -488,8 +2764,11 @@ def build_app(base_dir, allow_delete=False, pin=None):
             return jsonify({'error': 'No session ID provided'}), 400
         
         with upload_lock:
-            if session_id in upload_sessions:
-                upload_sessions[session_id]['cancelled'] = True
+            upload = upload_sessions.get(session_id)
+            if upload is not None:
+                upload.cancelled.set()
+                if upload.chunked:
+                    discard_upload(session_id)
                 return jsonify({'success': True})
         
         return jsonify({'error': 'Session not found'}), 404
@@ -502,12 +2781,17 @@ def build_app(base_dir, allow_delete=False, pin=None):
         if not allow_delete:
             abort(403)
             
-        full_path = os.path.join(base_dir, filename)
-        if os.path.exists(full_path):
+        full_path = share_path(filename)
+        # "." or "a/.." resolve to the share root, which is not deletable
+        if full_path and os.path.exists(full_path) and os.path.realpath(full_path) != os.path.realpath(base_dir):
             if os.path.isdir(full_path):
                 shutil.rmtree(full_path)
             else:
                 os.remove(full_path)
+            watcher.invalidate(full_path)
+        parent = os.path.dirname(filename.rstrip('/'))
+        if parent:
+            return redirect(url_for('browse', subpath=parent))
         return redirect(url_for('index'))
 
     return app
@@ -781,6 +3065,44 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             border-radius: 6px 6px 0 0;
         }
         .file-table tr:last-child td { border-bottom: none; }
+        /* Stand-ins for the rows scrolled out of the rendered window */
+        .file-table tr.row-spacer td { padding: 0; border: none; }
+        .file-table th.sortable { cursor: pointer; user-select: none; }
+        .file-table th.sortable.asc::after { content: " ▲"; font-size: 10px; }
+        .file-table th.sortable.desc::after { content: " ▼"; font-size: 10px; }
+        
+        .list-header {
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            margin-bottom: 15px;
+            gap: 10px;
+            flex-wrap: wrap;
+        }
+        .list-header h3.section-title { margin-bottom: 0; }
+        .list-header select {
+            padding: 6px 10px;
+            border: 1px solid #dfe3e8;
+            border-radius: 6px;
+            font-size: 13px;
+            background: white;
+        }
+        .breadcrumbs {
+            margin-bottom: 15px;
+            font-size: 14px;
+            color: #7f8c8d;
+            word-break: break-word;
+        }
+        .breadcrumbs a { color: #3498db; text-decoration: none; }
+        .breadcrumbs a:hover { text-decoration: underline; }
+        .file-name-cell a { color: inherit; text-decoration: none; }
+        .file-name-cell a:hover { color: #3498db; }
+        .list-status {
+            text-align: center;
+            color: #95a5a6;
+            font-size: 13px;
+            padding: 10px;
+        }
         
         .file-name-cell {
             display: flex;
@@ -788,6 +3110,15 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             word-break: break-word;
         }
         .file-icon { margin-right: 10px; font-size: 18px; }
+        .file-thumb {
+            width: 48px;
+            height: 48px;
+            margin-right: 10px;
+            flex-shrink: 0;
+            object-fit: cover;
+            border-radius: 4px;
+            background: #ecf0f1;
+        }
         
         .actions { 
             display: flex; 
@@ -905,7 +3236,7 @@ HTML_TEMPLATE = """<!DOCTYPE html>
     </style>
 </head>
 <body>
-  <div class="container">
+  <div class="container" data-listing-generation="{{ generation }}">
     <div class="header">
         <h1>🔗 LocalShare</h1>
         <div class="user-info-group">
@@ -943,53 +3274,37 @@ HTML_TEMPLATE = """<!DOCTYPE html>
       </div>
     </div>
 
-    <h3 class="section-title">📋 Files & Folders</h3>
-    {% if files %}
-      <table class="file-table">
+    <div class="list-header">
+      <h3 class="section-title">📋 Files & Folders</h3>
+      <select id="typeFilter" aria-label="Filter by type">
+        <option value="">All files</option>
+        <option value="video">Videos</option>
+        <option value="audio">Audio</option>
+        <option value="image">Images</option>
+        <option value="subtitle">Subtitles</option>
+      </select>
+    </div>
+    {% if breadcrumbs %}
+    <div class="breadcrumbs">
+      <a href="{{ url_for('index') }}">🏠 Home</a>
+      {% for crumb in breadcrumbs %}
+      / {% if loop.last %}<strong>{{ crumb.name }}</strong>{% else %}<a href="{{ url_for('browse', subpath=crumb.path) }}">{{ crumb.name }}</a>{% endif %}
+      {% endfor %}
+    </div>
+    {% endif %}
+      <table class="file-table" id="fileTable" style="display:none">
         <thead>
           <tr>
-            <th>Name</th>
-            <th>Size</th>
-            <th>Modified</th>
+            <th class="sortable" data-sort="name">Name</th>
+            <th class="sortable" data-sort="size">Size</th>
+            <th class="sortable" data-sort="mtime">Modified</th>
             <th>Actions</th>
           </tr>
         </thead>
-        <tbody>
-          {% for f in files %}
-          <tr>
-            <td>
-              <div class="file-name-cell">
-                  <span class="file-icon">{% if f.is_dir %}📁{% else %}📄{% endif %}</span>
-                  {{ f.name }}
-              </div>
-            </td>
-            <td>{{ f.size_h }}</td>
-            <td>{{ f.mtime_h }}</td>
-            <td>
-              <div class="actions">
-                {% if f.can_stream %}
-                <a class="btn btn-small btn-info" href="{{ url_for('stream', filename=f.name) }}">
-                  {% if f.is_image %}View{% elif f.is_video %}Stream{% else %}Play{% endif %}
-                </a>
-                {% endif %}
-                <a class="btn btn-small" href="{{ url_for('files', filename=f.name) }}">
-                  {% if f.is_dir %}ZIP{% else %}Down{% endif %}
-                </a>
-                {% if allow_delete %}
-                <form action="{{ url_for('delete_file', filename=f.name) }}" method="post" style="display:inline; flex: 1;">
-                  <button class="btn btn-small btn-danger" style="width:100%" type="submit" 
-                          onclick="return confirm('Delete {{ f.name }}?')">Del</button>
-                </form>
-                {% endif %}
-              </div>
-            </td>
-          </tr>
-          {% endfor %}
-        </tbody>
+        <tbody id="fileRows"></tbody>
       </table>
-    {% else %}
-      <p class="muted">🔭 No files yet. Upload something to get started!</p>
-    {% endif %}
+      <p class="muted" id="emptyMessage" style="display:none">🔭 No files yet. Upload something to get started!</p>
+      <div class="list-status" id="listStatus">Loading...</div>
   </div>
 
   <footer>
@@ -1005,8 +3320,232 @@ HTML_TEMPLATE = """<!DOCTYPE html>
     const uploadStatus = document.getElementById('uploadStatus');
     const cancelBtn = document.getElementById('cancelBtn');
 
-    let currentUploadXHR = null;
-    let currentSessionId = null;
+    // Files up to one chunk go in a single multipart POST; bigger ones are
+    // sent in chunks that can be resumed after a failure
+    const CHUNK_SIZE = {{ upload_chunk_size }};
+    const CHUNK_RETRIES = 4;
+    const UPLOAD_PARALLEL = 4;
+    const DEDUP = {{ 'true' if dedup else 'false' }};
+    const RESUME_PREFIX = 'localshare-upload:';
+    const THUMB_EXTENSIONS = {{ thumb_extensions|tojson }};
+    const VIDEO_POSTERS = {{ 'true' if video_posters else 'false' }};
+    let activeUpload = null;
+
+    // ----- File list: fetched page by page from /api/list while scrolling -----
+    // Only the rows near the viewport exist in the DOM; spacer rows stand in
+    // for the rest, so the page stays light however far the list is scrolled
+    const fileTable = document.getElementById('fileTable');
+    const fileRows = document.getElementById('fileRows');
+    const emptyMessage = document.getElementById('emptyMessage');
+    const listStatus = document.getElementById('listStatus');
+    const typeFilter = document.getElementById('typeFilter');
+    const allowDelete = {{ 'true' if allow_delete else 'false' }};
+    const currentPath = {{ current_path|tojson }};
+    const listState = { sort: 'mtime', order: 'desc', type: '', cursor: null, done: false, loading: false, request: 0,
+                        entries: [], windowStart: 0, windowEnd: 0 };
+    const ROW_OVERSCAN = 40;  // rows kept rendered above and below the viewport
+    let rowHeight = 0;        // measured from the first rendered rows
+
+    function encodePath(path) {
+      return path.split('/').map(encodeURIComponent).join('/');
+    }
+
+    function makeLink(className, href, text) {
+      const a = document.createElement('a');
+      a.className = className;
+      a.href = href;
+      a.textContent = text;
+      return a;
+    }
+
+    function renderRow(f) {
+      const tr = document.createElement('tr');
+      const nameCell = document.createElement('td');
+      const nameDiv = document.createElement('div');
+      nameDiv.className = 'file-name-cell';
+      const icon = document.createElement('span');
+      icon.className = 'file-icon';
+      icon.textContent = f.is_dir ? '📁' : '📄';
+      const ext = f.name.includes('.') ? f.name.slice(f.name.lastIndexOf('.')).toLowerCase() : '';
+      let previewUrl = null;
+      if (!f.is_dir && THUMB_EXTENSIONS.includes(ext)) previewUrl = '/thumb/';
+      else if (VIDEO_POSTERS && f.is_video) previewUrl = '/poster/';
+      if (previewUrl) {
+        // Small server-made preview; the version makes it cacheable for good
+        const thumb = document.createElement('img');
+        thumb.className = 'file-thumb';
+        thumb.loading = 'lazy';
+        thumb.alt = '';
+        thumb.src = previewUrl + encodePath(f.path) + '?v=' + f.mtime + '-' + f.size;
+        thumb.onerror = () => thumb.replaceWith(icon);
+        nameDiv.appendChild(thumb);
+      } else {
+        nameDiv.appendChild(icon);
+      }
+      if (f.is_dir) {
+        nameDiv.appendChild(makeLink('', '/browse/' + encodePath(f.path), f.name));
+      } else {
+        nameDiv.appendChild(document.createTextNode(f.name));
+      }
+      nameCell.appendChild(nameDiv);
+      tr.appendChild(nameCell);
+
+      const sizeCell = document.createElement('td');
+      sizeCell.textContent = f.size_h;
+      tr.appendChild(sizeCell);
+      const dateCell = document.createElement('td');
+      dateCell.textContent = f.mtime_h;
+      tr.appendChild(dateCell);
+
+      const actionsCell = document.createElement('td');
+      const actions = document.createElement('div');
+      actions.className = 'actions';
+      if (f.can_stream) {
+        actions.appendChild(makeLink('btn btn-small btn-info', '/stream/' + encodePath(f.path),
+                                     f.is_image ? 'View' : (f.is_video ? 'Stream' : 'Play')));
+      }
+      actions.appendChild(makeLink('btn btn-small', '/files/' + encodePath(f.path), f.is_dir ? 'ZIP' : 'Down'));
+      if (allowDelete) {
+        const form = document.createElement('form');
+        form.method = 'post';
+        form.action = '/delete/' + encodePath(f.path);
+        form.style.cssText = 'display:inline; flex: 1;';
+        const button = document.createElement('button');
+        button.className = 'btn btn-small btn-danger';
+        button.style.width = '100%';
+        button.type = 'submit';
+        button.textContent = 'Del';
+        button.onclick = () => confirm('Delete ' + f.name + '?');
+        form.appendChild(button);
+        actions.appendChild(form);
+      }
+      actionsCell.appendChild(actions);
+      tr.appendChild(actionsCell);
+      return tr;
+    }
+
+    function spacerRow(height) {
+      const tr = document.createElement('tr');
+      tr.className = 'row-spacer';
+      const td = document.createElement('td');
+      td.colSpan = 4;
+      td.style.height = height + 'px';
+      tr.appendChild(td);
+      return tr;
+    }
+
+    function renderWindow(force) {
+      const entries = listState.entries;
+      const estimate = rowHeight || 50;
+      const first = Math.floor(Math.max(0, -fileRows.getBoundingClientRect().top) / estimate);
+      const last = first + Math.ceil(window.innerHeight / estimate);
+      // Scrolling within the overscan keeps the rows that are already there
+      if (!force && listState.windowStart <= Math.max(0, first - ROW_OVERSCAN / 2) &&
+          listState.windowEnd >= Math.min(entries.length, last + ROW_OVERSCAN / 2)) return;
+      const start = Math.max(0, first - ROW_OVERSCAN);
+      const end = Math.min(entries.length, last + ROW_OVERSCAN);
+      const fragment = document.createDocumentFragment();
+      fragment.appendChild(spacerRow(start * estimate));
+      for (let i = start; i < end; i++) fragment.appendChild(renderRow(entries[i]));
+      fragment.appendChild(spacerRow((entries.length - end) * estimate));
+      fileRows.textContent = '';
+      fileRows.appendChild(fragment);
+      listState.windowStart = start;
+      listState.windowEnd = end;
+      if (!rowHeight && end > start) {
+        rowHeight = (fileRows.lastChild.offsetTop - fileRows.firstChild.nextSibling.offsetTop) / (end - start) || 50;
+        renderWindow(true);
+      }
+    }
+
+    let windowFrame = null;
+    function scheduleWindow() {
+      if (windowFrame === null) {
+        windowFrame = requestAnimationFrame(() => {
+          windowFrame = null;
+          renderWindow(false);
+        });
+      }
+    }
+    window.addEventListener('scroll', scheduleWindow, { passive: true });
+    window.addEventListener('resize', scheduleWindow);
+
+    function updateSortHeaders() {
+      document.querySelectorAll('.file-table th.sortable').forEach(th => {
+        th.classList.remove('asc', 'desc');
+        if (th.dataset.sort === listState.sort) th.classList.add(listState.order);
+      });
+    }
+
+    function loadMore() {
+      if (listState.loading || listState.done) return;
+      listState.loading = true;
+      const request = listState.request;
+      const params = new URLSearchParams({ sort: listState.sort, order: listState.order, limit: 100 });
+      if (currentPath) params.set('path', currentPath);
+      if (listState.type) params.set('type', listState.type);
+      if (listState.cursor) params.set('cursor', listState.cursor);
+      fetch('{{ url_for("api_list") }}?' + params)
+        .then(response => response.json())
+        .then(data => {
+          if (request !== listState.request) return;  // sort or filter changed meanwhile
+          data.entries.forEach(f => listState.entries.push(f));
+          listState.cursor = data.next_cursor;
+          listState.done = !data.next_cursor;
+          listState.loading = false;
+          const hasRows = listState.entries.length > 0;
+          fileTable.style.display = hasRows ? '' : 'none';
+          if (hasRows) renderWindow(true);
+          emptyMessage.style.display = hasRows ? 'none' : 'block';
+          emptyMessage.textContent = listState.type ? 'No matching files.' : '🔭 No files yet. Upload something to get started!';
+          listStatus.textContent = listState.done ? '' : 'Loading more...';
+          // Re-observing fires again right away if the end of the list is still in view
+          listObserver.unobserve(listStatus);
+          listObserver.observe(listStatus);
+        })
+        .catch(err => {
+          listState.loading = false;
+          listStatus.textContent = 'Failed to load files.';
+          console.error('Failed to load files:', err);
+        });
+    }
+
+    function reloadList() {
+      listState.request++;
+      listState.cursor = null;
+      listState.done = false;
+      listState.loading = false;
+      listState.entries = [];
+      listState.windowStart = listState.windowEnd = 0;
+      fileRows.textContent = '';
+      listStatus.textContent = 'Loading...';
+      updateSortHeaders();
+      loadMore();
+    }
+
+    const listObserver = new IntersectionObserver(entries => {
+      if (entries[0].isIntersecting) loadMore();
+    }, { rootMargin: '800px' });
+
+    document.querySelectorAll('.file-table th.sortable').forEach(th => {
+      th.addEventListener('click', () => {
+        if (listState.sort === th.dataset.sort) {
+          listState.order = listState.order === 'asc' ? 'desc' : 'asc';
+        } else {
+          listState.sort = th.dataset.sort;
+          listState.order = th.dataset.sort === 'name' ? 'asc' : 'desc';
+        }
+        reloadList();
+      });
+    });
+
+    typeFilter.addEventListener('change', () => {
+      listState.type = typeFilter.value;
+      reloadList();
+    });
+
+    updateSortHeaders();
+    listObserver.observe(listStatus);
 
     function updateUserCount() {
       fetch('{{ url_for("stats") }}')
@@ -1100,44 +3639,283 @@ HTML_TEMPLATE = """<!DOCTYPE html>
     });
 
     function cancelUpload() {
-      if (currentSessionId && currentUploadXHR) {
-        // Send cancel request to server
+      const upload = activeUpload;
+      if (!upload || upload.cancelled) return;
+      upload.cancelled = true;
+      upload.sessions.forEach(sessionId => {
         fetch('{{ url_for("cancel_upload") }}', {
           method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ session_id: currentSessionId })
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ session_id: sessionId })
         });
+      });
+      upload.xhrs.forEach(xhr => xhr.abort());
+      upload.resumeKeys.forEach(forgetSession);
+    }
 
-        // Abort the XHR request
-        currentUploadXHR.abort();
-        
-        uploadStatus.textContent = 'Upload cancelled';
-        uploadStatus.style.color = '#e74c3c';
-        progressFill.style.background = '#e74c3c';
-        
-        setTimeout(() => {
-          progressContainer.style.display = 'none';
-          progressFill.style.background = 'linear-gradient(90deg, #3498db, #2ecc71)';
-          uploadStatus.style.color = '#7f8c8d';
-          currentUploadXHR = null;
-          currentSessionId = null;
-        }, 2000);
-      }
+    function rememberSession(key, sessionId) {
+      try { localStorage.setItem(key, sessionId); } catch (e) {}
     }
 
-    function uploadFiles(files) {
+    function recallSession(key) {
+      try { return localStorage.getItem(key); } catch (e) { return null; }
+    }
+
+    function forgetSession(key) {
+      try { localStorage.removeItem(key); } catch (e) {}
+    }
+
+    // One XHR; resolves with the parsed JSON reply, rejects with the status
+    function sendRequest(upload, method, url, body, headers) {
+      return new Promise((resolve, reject) => {
+        if (upload.cancelled) return reject({ status: 499 });
+        const xhr = new XMLHttpRequest();
+        upload.xhrs.add(xhr);
+        xhr.open(method, url);
+        Object.keys(headers || {}).forEach(name => xhr.setRequestHeader(name, headers[name]));
+        xhr.upload.addEventListener('progress', e => {
+          upload.inflight.set(xhr, e.loaded);
+          updateUploadProgress(upload);
+        });
+        const done = () => {
+          upload.xhrs.delete(xhr);
+          upload.inflight.delete(xhr);
+        };
+        xhr.addEventListener('load', () => {
+          done();
+          let data = null;
+          try { data = JSON.parse(xhr.responseText); } catch (e) {}
+          if (xhr.status === 200) resolve(data);
+          else reject({ status: xhr.status, data: data });
+        });
+        xhr.addEventListener('error', () => { done(); reject({ status: 0 }); });
+        xhr.addEventListener('abort', () => { done(); reject({ status: 499 }); });
+        xhr.send(body);
+      });
+    }
+
+    function updateUploadProgress(upload) {
+      let loaded = upload.done;
+      upload.inflight.forEach(bytes => { loaded += bytes; });
+      const percent = upload.total ? Math.min(100, Math.round(loaded / upload.total * 100)) : 100;
+      progressFill.style.width = percent + '%';
+      progressFill.textContent = percent + '%';
+    }
+
+    function uploadSmallFiles(upload, files) {
+      if (!files.length) return Promise.resolve();
       const formData = new FormData();
-      
-      // Generate unique session ID
-      currentSessionId = 'upload_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
-      
+      formData.append('dir', currentPath);
+      // The server streams the body, so each path has to arrive before its file
       files.forEach((file, index) => {
-        formData.append('file', file);
         const relativePath = file.webkitRelativePath || file.relativePath || file.name;
         formData.append(`path_${index}`, relativePath);
+        formData.append('file', file);
+      });
+      const sessionId = 'upload_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
+      upload.sessions.add(sessionId);
+      const bytes = files.reduce((sum, file) => sum + file.size, 0);
+      return sendRequest(upload, 'POST', '{{ url_for("upload_file") }}', formData,
+                         { 'X-Upload-Session-ID': sessionId })
+        .then(() => {
+          upload.sessions.delete(sessionId);
+          upload.done += bytes;
+        });
+    }
+
+    function withRetries(upload, attempt) {
+      const run = n => attempt().catch(err => {
+        if (upload.cancelled) throw err;
+        // A busy server (429) is waited out without using up the retries
+        if (err.status === 429) return new Promise(resolve => setTimeout(resolve, 1000)).then(() => run(n));
+        // Otherwise only network failures and server errors are worth another go
+        if (n >= CHUNK_RETRIES || (err.status !== 0 && err.status < 500)) throw err;
+        return new Promise(resolve => setTimeout(resolve, 1000 * Math.pow(2, n))).then(() => run(n + 1));
+      });
+      return run(0);
+    }
+
+    // SHA-256 for the dedup check. crypto.subtle only exists on HTTPS pages,
+    // and the share is served over plain HTTP
+    const SHA256_K = new Int32Array([
+      0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+      0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+      0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+      0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+      0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+      0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+      0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+      0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2]);
+
+    function Sha256() {
+      // Int32Array keeps every word a small integer for the JIT
+      this.h = new Int32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a,
+                                0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+      this.w = new Int32Array(64);
+      this.buffer = new Uint8Array(64);
+      this.buffered = 0;
+      this.length = 0;
+    }
+
+    Sha256.prototype.block = function (bytes, p) {
+      const w = this.w, h = this.h;
+      for (let i = 0; i < 16; i++, p += 4) {
+        w[i] = (bytes[p] << 24) | (bytes[p + 1] << 16) | (bytes[p + 2] << 8) | bytes[p + 3];
+      }
+      for (let i = 16; i < 64; i++) {
+        const x = w[i - 15], y = w[i - 2];
+        const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+        const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+        w[i] = (w[i - 16] + s0 + w[i - 7] + s1) | 0;
+      }
+      let a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+      for (let i = 0; i < 64; i++) {
+        const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+        const t1 = (k + S1 + ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+        const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+        const t2 = (S0 + ((a & b) ^ (a & c) ^ (b & c))) | 0;
+        k = g; g = f; f = e; e = (d + t1) | 0; d = c; c = b; b = a; a = (t1 + t2) | 0;
+      }
+      h[0] = (h[0] + a) | 0; h[1] = (h[1] + b) | 0; h[2] = (h[2] + c) | 0; h[3] = (h[3] + d) | 0;
+      h[4] = (h[4] + e) | 0; h[5] = (h[5] + f) | 0; h[6] = (h[6] + g) | 0; h[7] = (h[7] + k) | 0;
+    };
+
+    Sha256.prototype.update = function (bytes) {
+      let i = 0;
+      this.length += bytes.length;
+      if (this.buffered) {
+        i = Math.min(64 - this.buffered, bytes.length);
+        this.buffer.set(bytes.subarray(0, i), this.buffered);
+        this.buffered += i;
+        if (this.buffered < 64) return;
+        this.block(this.buffer, 0);
+        this.buffered = 0;
+      }
+      for (; i + 64 <= bytes.length; i += 64) this.block(bytes, i);
+      if (i < bytes.length) {
+        this.buffer.set(bytes.subarray(i), 0);
+        this.buffered = bytes.length - i;
+      }
+    };
+
+    Sha256.prototype.hex = function () {
+      const length = this.length;
+      const pad = new Uint8Array((this.buffered < 56 ? 64 : 128) - this.buffered);
+      pad[0] = 0x80;
+      const view = new DataView(pad.buffer);
+      view.setUint32(pad.length - 8, Math.floor(length / 0x20000000));
+      view.setUint32(pad.length - 4, (length % 0x20000000) * 8);
+      this.update(pad);
+      return Array.from(this.h, x => ('0000000' + (x >>> 0).toString(16)).slice(-8)).join('');
+    };
+
+    function hashFile(upload, file) {
+      const sha = new Sha256();
+      const step = 4 * 1024 * 1024;
+      const next = offset => {
+        if (upload.cancelled) return Promise.reject({ status: 499 });
+        if (offset >= file.size) return Promise.resolve(sha.hex());
+        uploadStatus.textContent = `Checking ${file.name}... ${Math.round(offset / file.size * 100)}%`;
+        return file.slice(offset, offset + step).arrayBuffer().then(buffer => {
+          sha.update(new Uint8Array(buffer));
+          return next(offset + step);
+        });
+      };
+      return next(0);
+    }
+
+    // Asks the server for the file by size first; only a size it has seen
+    // before is worth hashing the whole file for
+    function alreadyOnServer(upload, file, relativePath) {
+      const check = body => sendRequest(upload, 'POST', '{{ url_for("upload_check") }}', JSON.stringify(body),
+                                        { 'Content-Type': 'application/json' });
+      return check({ size: file.size }).then(data => {
+        if (!data.known_size) return false;
+        return hashFile(upload, file)
+          .then(digest => check({ size: file.size, sha256: digest, path: relativePath, dir: currentPath }))
+          .then(result => {
+            uploadStatus.textContent = `Uploading ${upload.count} file(s)...`;
+            return result.exists;
+          });
       });
+    }
+
+    function uploadChunked(upload, file) {
+      const relativePath = file.webkitRelativePath || file.relativePath || file.name;
+      const resumeKey = RESUME_PREFIX + [currentPath, relativePath, file.size, file.lastModified].join('|');
+      const saved = recallSession(resumeKey);
+      const sessionUrl = id => '{{ url_for("upload_file") }}/' + encodeURIComponent(id);
+      const resumed = saved ? sendRequest(upload, 'GET', sessionUrl(saved)).catch(err => {
+        if (err.status === 499) throw err;
+        return null;  // expired or from an earlier server run
+      }) : Promise.resolve(null);
+
+      const startUpload = () => sendRequest(upload, 'POST', '{{ url_for("upload_init") }}',
+        JSON.stringify({ path: relativePath, size: file.size, dir: currentPath }),
+        { 'Content-Type': 'application/json' });
+
+      return resumed
+        .then(status => {
+          if (status || !DEDUP) return status || startUpload();
+          return alreadyOnServer(upload, file, relativePath).then(found => found ? null : startUpload());
+        })
+        .then(status => {
+          if (!status) {
+            // The server made its own copy; nothing to send
+            upload.done += file.size;
+            updateUploadProgress(upload);
+            return;
+          }
+          const sessionId = status.session_id;
+          rememberSession(resumeKey, sessionId);
+          upload.resumeKeys.add(resumeKey);
+          upload.sessions.add(sessionId);
+          const pieces = [];
+          status.missing.forEach(([start, end]) => {
+            for (let offset = start; offset < end; offset += status.chunk_size) {
+              pieces.push([offset, Math.min(end, offset + status.chunk_size)]);
+            }
+          });
+          const missingBytes = pieces.reduce((sum, [start, end]) => sum + end - start, 0);
+          upload.done += file.size - missingBytes;
+          updateUploadProgress(upload);
+
+          // A few chunks in flight at once; one TCP stream rarely fills Wi-Fi
+          const sendNext = () => {
+            const piece = pieces.shift();
+            if (!piece) return Promise.resolve();
+            const [start, end] = piece;
+            return withRetries(upload, () =>
+              sendRequest(upload, 'PUT', sessionUrl(sessionId) + '?offset=' + start, file.slice(start, end))
+            ).then(() => {
+              upload.done += end - start;
+              return sendNext();
+            }, err => {
+              pieces.length = 0;  // stop the other workers too
+              throw err;
+            });
+          };
+          const workers = [];
+          for (let i = 0; i < Math.min(UPLOAD_PARALLEL, status.parallel); i++) workers.push(sendNext());
+          return Promise.all(workers)
+            .then(() => withRetries(upload, () => sendRequest(upload, 'POST', sessionUrl(sessionId) + '/finalize')))
+            .then(() => {
+              forgetSession(resumeKey);
+              upload.resumeKeys.delete(resumeKey);
+              upload.sessions.delete(sessionId);
+            });
+        });
+    }
+
+    function uploadFiles(files) {
+      if (activeUpload) return;
+      const upload = { cancelled: false, xhrs: new Set(), inflight: new Map(), sessions: new Set(),
+                       resumeKeys: new Set(), done: 0, total: 0 };
+      activeUpload = upload;
+      const small = files.filter(file => file.size <= CHUNK_SIZE);
+      const large = files.filter(file => file.size > CHUNK_SIZE);
+      upload.total = files.reduce((sum, file) => sum + file.size, 0);
+      upload.count = files.length;
 
       progressContainer.style.display = 'block';
       progressFill.style.width = '0%';
@@ -1145,57 +3923,42 @@ HTML_TEMPLATE = """<!DOCTYPE html>
       uploadStatus.textContent = `Uploading ${files.length} file(s)...`;
       uploadStatus.style.color = '#7f8c8d';
       cancelBtn.disabled = false;
+      fileInput.value = '';
+      folderInput.value = '';
 
-      currentUploadXHR = new XMLHttpRequest();
-
-      currentUploadXHR.upload.addEventListener('progress', (e) => {
-        if (e.lengthComputable) {
-          const percentComplete = Math.round((e.loaded / e.total) * 100);
-          progressFill.style.width = percentComplete + '%';
-          progressFill.textContent = percentComplete + '%';
-        }
+      let chain = uploadSmallFiles(upload, small);
+      large.forEach(file => {
+        chain = chain.then(() => {
+          upload.current = file;
+          return uploadChunked(upload, file);
+        });
       });
-
-      currentUploadXHR.addEventListener('load', () => {
-        if (currentUploadXHR.status === 200) {
-          progressFill.style.width = '100%';
-          progressFill.textContent = '✓';
-          uploadStatus.textContent = 'Complete! Refreshing...';
-          cancelBtn.disabled = true;
-          setTimeout(() => {
-            location.reload();
-          }, 1000);
-        } else if (currentUploadXHR.status === 499) {
-          // Upload was cancelled
+      chain.then(() => {
+        progressFill.style.width = '100%';
+        progressFill.textContent = '✓';
+        uploadStatus.textContent = 'Complete! Refreshing...';
+        cancelBtn.disabled = true;
+        setTimeout(() => {
+          location.reload();
+        }, 1000);
+      }).catch(err => {
+        cancelBtn.disabled = true;
+        uploadStatus.style.color = '#e74c3c';
+        if (upload.cancelled || err.status === 499) {
           uploadStatus.textContent = 'Upload cancelled';
-          uploadStatus.style.color = '#e74c3c';
           progressFill.style.background = '#e74c3c';
+          setTimeout(() => {
+            progressContainer.style.display = 'none';
+            progressFill.style.background = 'linear-gradient(90deg, #3498db, #2ecc71)';
+            uploadStatus.style.color = '#7f8c8d';
+          }, 2000);
+        } else if (upload.resumeKeys.size) {
+          uploadStatus.textContent = `Upload of ${upload.current.name} failed. Select it again to resume.`;
         } else {
           uploadStatus.textContent = 'Upload failed.';
-          uploadStatus.style.color = '#e74c3c';
-          cancelBtn.disabled = true;
         }
+        activeUpload = null;
       });
-
-      currentUploadXHR.addEventListener('error', () => {
-        uploadStatus.textContent = 'Upload failed.';
-        uploadStatus.style.color = '#e74c3c';
-        cancelBtn.disabled = true;
-      });
-
-      currentUploadXHR.addEventListener('abort', () => {
-        uploadStatus.textContent = 'Upload cancelled';
-        uploadStatus.style.color = '#e74c3c';
-        progressFill.style.background = '#e74c3c';
-        cancelBtn.disabled = true;
-      });
-
-      currentUploadXHR.open('POST', '{{ url_for("upload_file") }}');
-      currentUploadXHR.setRequestHeader('X-Upload-Session-ID', currentSessionId);
-      currentUploadXHR.send(formData);
-
-      fileInput.value = '';
-      folderInput.value = '';
     }
   </script>
 </body>
@@ -1388,6 +4151,36 @@ VIDEO_PLAYER_TEMPLATE = """<!DOCTYPE html>
             display: none;
         }
         
+        .seek-bar {
+            position: relative;
+            height: 14px;
+            margin-top: 12px;
+            background: #2a2a2a;
+            border-radius: 7px;
+            cursor: pointer;
+            touch-action: none;
+        }
+        .seek-progress {
+            height: 100%;
+            width: 0;
+            background: #3498db;
+            border-radius: 7px;
+            pointer-events: none;
+        }
+        .seek-preview {
+            position: absolute;
+            bottom: 22px;
+            display: none;
+            padding: 3px;
+            background: #000;
+            border-radius: 4px;
+            box-shadow: 0 3px 12px rgba(0,0,0,0.6);
+            pointer-events: none;
+            text-align: center;
+            font-size: 12px;
+        }
+        .seek-thumb { background-repeat: no-repeat; margin-bottom: 3px; }
+        
     </style>
 </head>
 <body>
@@ -1400,11 +4193,18 @@ VIDEO_PLAYER_TEMPLATE = """<!DOCTYPE html>
     </div>
 
     <div class="main-content">
-        <video id="videoPlayer" controls preload="metadata" crossorigin="anonymous">
+        <video id="videoPlayer" controls preload="metadata" crossorigin="anonymous"{% if poster_url %} poster="{{ poster_url }}"{% endif %}>
             <source src="{{ file_url }}" type="video/mp4">
             <track id="subtitleTrack" label="Subtitle" kind="subtitles" srclang="en" default>
             Your browser does not support the video tag.
         </video>
+        <div class="seek-bar" id="seekBar" hidden>
+            <div class="seek-progress" id="seekProgress"></div>
+            <div class="seek-preview" id="seekPreview">
+                <div class="seek-thumb" id="seekThumb"></div>
+                <span id="seekTime"></span>
+            </div>
+        </div>
 
         <div class="controls-area">
             <h4>💬 Subtitles</h4>
@@ -1415,7 +4215,7 @@ VIDEO_PLAYER_TEMPLATE = """<!DOCTYPE html>
                     <select id="serverSubSelect">
                         <option value="">-- Select a subtitle --</option>
                         {% for sub in subtitles %}
-                        <option value="{{ sub }}">{{ sub }}</option>
+                        <option value="{{ sub }}">{{ sub.rsplit("/", 1)[-1] }}</option>
                         {% endfor %}
                     </select>
                 </div>
@@ -1469,7 +4269,7 @@ VIDEO_PLAYER_TEMPLATE = """<!DOCTYPE html>
 
         // Helper to convert SRT content to WebVTT blob URL
         function srtToVttBlob(srtContent) {
-            let vtt = "WEBVTT\n\n";
+            let vtt = "WEBVTT\\n\\n";
             // Replace comma with dot in timestamps
             vtt += srtContent.replace(/(\\d{2}:\\d{2}:\\d{2}),(\\d{3})/g, '$1.$2');
             const blob = new Blob([vtt], { type: 'text/vtt' });
@@ -1530,7 +4330,7 @@ VIDEO_PLAYER_TEMPLATE = """<!DOCTYPE html>
         serverSelect.addEventListener('change', (e) => {
             if(e.target.value) {
                 // We use the view route to fetch the raw text content
-                loadSubtitle('/view/' + encodeURIComponent(e.target.value), false);
+                loadSubtitle('/view/' + e.target.value.split('/').map(encodeURIComponent).join('/'), false);
                 localInput.value = ''; // Reset other input
             }
         });
@@ -1543,6 +4343,59 @@ VIDEO_PLAYER_TEMPLATE = """<!DOCTYPE html>
                 serverSelect.value = ''; // Reset other input
             }
         });
+
+        // Seek preview: hovering the bar below the player shows the frame at
+        // that point from one server-made sprite sheet, so scrubbing doesn't
+        // fire range requests into the video
+        const previewsUrl = {{ previews_url|tojson }};
+        const seekBar = document.getElementById('seekBar');
+        const seekProgress = document.getElementById('seekProgress');
+        const seekPreview = document.getElementById('seekPreview');
+        const seekThumb = document.getElementById('seekThumb');
+        const seekTime = document.getElementById('seekTime');
+
+        function formatTime(t) {
+            const h = Math.floor(t / 3600), m = Math.floor(t / 60) % 60, s = Math.floor(t) % 60;
+            return (h ? h + ':' + String(m).padStart(2, '0') : m) + ':' + String(s).padStart(2, '0');
+        }
+
+        function setupSeekPreview(info) {
+            const duration = () => video.duration || info.duration;
+            seekThumb.style.width = info.tile_width + 'px';
+            seekThumb.style.height = info.tile_height + 'px';
+            seekThumb.style.backgroundImage = 'url("' + info.sprite + '")';
+            seekBar.hidden = false;
+
+            function timeAt(e) {
+                const rect = seekBar.getBoundingClientRect();
+                const x = Math.min(Math.max(e.clientX - rect.left, 0), rect.width);
+                return { x: x, width: rect.width, t: x / rect.width * duration() };
+            }
+
+            seekBar.addEventListener('pointermove', (e) => {
+                const p = timeAt(e);
+                const i = Math.min(info.count - 1, Math.floor(p.t / info.interval));
+                const col = i % info.columns, row = Math.floor(i / info.columns);
+                seekThumb.style.backgroundPosition = (-col * info.tile_width) + 'px ' + (-row * info.tile_height) + 'px';
+                seekTime.textContent = formatTime(p.t);
+                seekPreview.style.display = 'block';
+                const half = seekPreview.offsetWidth / 2;
+                seekPreview.style.left = (Math.min(Math.max(p.x, half), p.width - half) - half) + 'px';
+            });
+            seekBar.addEventListener('pointerleave', () => { seekPreview.style.display = 'none'; });
+            seekBar.addEventListener('pointerup', () => { seekPreview.style.display = 'none'; });
+            seekBar.addEventListener('pointerdown', (e) => { video.currentTime = timeAt(e).t; });
+            video.addEventListener('timeupdate', () => {
+                seekProgress.style.width = (video.currentTime / duration() * 100) + '%';
+            });
+        }
+
+        if (previewsUrl) {
+            fetch(previewsUrl)
+                .then(r => r.ok ? r.json() : null)
+                .then(info => { if (info && info.sprite) setupSeekPreview(info); })
+                .catch(err => console.error('Seek previews unavailable:', err));
+        }
     </script>
 </body>
 </html>
@@ -1670,6 +4523,233 @@ def get_default_dir():
         return os.path.join(home, "LocalShare")
 
 
+# ---------- SERVERS ----------
+SERVER_BACKENDS = ('dev', 'waitress', 'asyncio')
+MAX_REQUEST_HEAD = 64 * 1024
+
+
+class _AsyncBodyReader(io.RawIOBase):
+    # wsgi.input for the asyncio backend: the app reads in its worker thread,
+    # each read waits for the event loop to receive that much from the client
+    def __init__(self, reader, writer, loop, length, timeout, expect_continue=False):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.remaining = length
+        self.timeout = timeout
+        self.expect_continue = expect_continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.remaining <= 0:
+            return 0
+        view = memoryview(b).cast('B')
+        coro = asyncio.wait_for(self._read(min(len(view), self.remaining)), self.timeout)
+        try:
+            data = asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+        except Exception:
+            data = b''
+        if not data:
+            self.remaining = -1  # connection is gone or stalled
+            return 0
+        self.remaining -= len(data)
+        view[:len(data)] = data
+        return len(data)
+
+    async def _read(self, n):
+        # Clients sending "Expect: 100-continue" hold the body back until
+        # the app actually starts reading it
+        if self.expect_continue:
+            self.expect_continue = False
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        return await self.reader.read(n)
+
+
+class AsyncWSGIServer:
+    # HTTP/1.1 server on asyncio for many concurrent media streams. The WSGI
+    # app still runs on a small thread pool, but FileRange bodies (/view,
+    # /files, cached ZIPs) are sent by loop.sendfile from the event loop, so
+    # an open stream or idle keep-alive connection costs a coroutine rather
+    # than a thread. Other bodies are pulled from the pool one chunk at a
+    # time, and bandwidth-limited ones are paced on the loop
+    def __init__(self, app, host, port, threads=16, timeout=120):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.threads = threads
+        self.timeout = timeout
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads,
+                                                          thread_name_prefix="wsgi")
+        server = await asyncio.start_server(self._connection, self.host, self.port,
+                                            limit=MAX_REQUEST_HEAD)
+        async with server:
+            await server.serve_forever()
+
+    async def _connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                keep_alive = await self._request(head, reader, writer, peer)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def _request(self, head, reader, writer, peer):
+        lines = head[:-4].decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.parse.unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': version,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'localshare.file_range': True,
+        }
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            key = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = environ[key] + ',' + value if key in environ else value
+        
+        connection = environ.get('HTTP_CONNECTION', '').lower()
+        keep_alive = 'close' not in connection if version == 'HTTP/1.1' else 'keep-alive' in connection
+        if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            writer.write(b'HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+            return False
+        expect_continue = environ.get('HTTP_EXPECT', '').lower() == '100-continue'
+        body_reader = _AsyncBodyReader(reader, writer, self.loop, length, self.timeout,
+                                       expect_continue and version == 'HTTP/1.1')
+        environ['wsgi.input'] = io.BufferedReader(body_reader, UPLOAD_BUFFER_SIZE)
+        
+        started = {}
+        def start_response(status, headers, exc_info=None):
+            started['status'] = status
+            started['headers'] = headers
+        
+        body = await self.loop.run_in_executor(self.pool, self.app, environ, start_response)
+        try:
+            headers = [(k, v) for k, v in started['headers'] if k.lower() != 'connection']
+            has_length = any(k.lower() == 'content-length' for k, v in headers)
+            code = int(started['status'][:3])
+            bodyless = method == 'HEAD' or code in (204, 304) or code < 200
+            chunked = not has_length and not bodyless and version == 'HTTP/1.1'
+            if not has_length and not bodyless and not chunked:
+                keep_alive = False  # only closing the connection ends the body
+            # Leftover request body would be parsed as the next request
+            if body_reader.remaining != 0:
+                keep_alive = False
+            if chunked:
+                headers.append(('Transfer-Encoding', 'chunked'))
+            headers.append(('Connection', 'keep-alive' if keep_alive else 'close'))
+            if not any(k.lower() == 'date' for k, v in headers):
+                headers.append(('Date', http_date()))
+            lines = [f"HTTP/1.1 {started['status']}"] + [f"{k}: {v}" for k, v in headers]
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            
+            if bodyless:
+                pass
+            elif isinstance(body, FileRange):
+                await writer.drain()
+                if body.throttle is None:
+                    await self.loop.sendfile(writer.transport, body.file, body.offset, body.length)
+                else:
+                    # Paced on the loop too, so a limited stream still holds no thread
+                    offset, remaining = body.offset, body.length
+                    while remaining > 0:
+                        n = min(remaining, BANDWIDTH_QUANTUM)
+                        delay = body.throttle.reserve(n)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                        sent = await self.loop.sendfile(writer.transport, body.file, offset, n)
+                        if not sent:
+                            break
+                        offset += sent
+                        remaining -= sent
+            else:
+                # Limited bodies are unwrapped: the pool only produces chunks,
+                # the pacing sleeps happen here and hold no thread
+                throttle = body.throttle if isinstance(body, Throttled) else None
+                iterator = iter(body if throttle is None else body.chunks)
+                while True:
+                    chunk = await self.loop.run_in_executor(self.pool, next, iterator, None)
+                    if chunk is None:
+                        break
+                    for piece in (quanta(chunk) if throttle is not None else (chunk,)):
+                        if not piece:
+                            continue
+                        if throttle is not None:
+                            delay = throttle.reserve(len(piece))
+                            if delay > 0:
+                                await asyncio.sleep(delay)
+                        if chunked:
+                            writer.write(b'%x\r\n' % len(piece) + piece + b'\r\n')
+                        else:
+                            writer.write(piece)
+                        await writer.drain()
+                if chunked:
+                    writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        finally:
+            if hasattr(body, 'close'):
+                await self.loop.run_in_executor(self.pool, body.close)
+        return keep_alive
+
+
+def run_server(app_obj, backend, host, port, threads=16, connection_limit=200, timeout=120):
+    if backend == 'waitress':
+        # Pure Python, so it installs offline from a wheel. A fixed pool of
+        # `threads` runs requests; the rest wait on the event loop, and idle
+        # keep-alive connections close after `timeout` seconds
+        from waitress import serve
+        serve(app_obj, host=host, port=port, threads=threads, connection_limit=connection_limit,
+              channel_timeout=timeout, asyncore_use_poll=True, ident='LocalShare',
+              max_request_body_size=app_obj.config['MAX_CONTENT_LENGTH'])
+    elif backend == 'asyncio':
+        AsyncWSGIServer(app_obj, host, port, threads=threads, timeout=timeout).run()
+    else:
+        app_obj.run(host=host, port=port, threaded=True)
+
+# ------------------------------------
+
+
 def main():
     global shared_dir
     
@@ -1680,30 +4760,83 @@ def main():
     parser.add_argument("--port", type=int, default=int(os.environ.get("LAN_SHARE_PORT", "5000")), help="Port to bind (default: 5000)")
     parser.add_argument("--disable-delete", action="store_true", help="Disable delete button")
     parser.add_argument("--pin", default=os.environ.get("LAN_SHARE_PIN", ""), help="Optional PIN required for access")
+    parser.add_argument("--zip-compression", choices=ZIP_COMPRESSION_MODES, default="auto",
+                        help="Compression for folder ZIPs: auto stores already-compressed files (default: auto)")
+    parser.add_argument("--zip-workers", type=int, default=None,
+                        help="Threads used to compress folder ZIPs (default: number of CPUs)")
+    parser.add_argument("--zip-cache-size", type=int, default=1024,
+                        help="Disk space in MB for cached folder ZIPs, 0 disables (default: 1024)")
+    parser.add_argument("--thumb-cache-size", type=int, default=256,
+                        help="Disk space in MB for image thumbnails (needs Pillow) and video posters and "
+                             "seek previews (needs ffmpeg), 0 disables (default: 256)")
+    parser.add_argument("--thumb-cache-dir", default=None,
+                        help="Keep thumbnails and video previews in a localshare-previews folder inside this "
+                             "directory so they survive restarts (default: temporary)")
+    parser.add_argument("--ffmpeg", default=shutil.which("ffmpeg"),
+                        help="ffmpeg used for video posters and seek previews (default: ffmpeg on PATH)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="Store identical uploads once (reflinks or hardlinks) and skip re-sending known files")
+    parser.add_argument("--bandwidth", type=float, default=0,
+                        help="Total transfer rate in MB/s shared by all clients, 0 for unlimited (default: 0)")
+    parser.add_argument("--client-bandwidth", type=float, default=0,
+                        help="Transfer rate in MB/s for each client IP, 0 for unlimited (default: 0)")
+    parser.add_argument("--server", choices=SERVER_BACKENDS, default="dev",
+                        help="HTTP server: Werkzeug's dev server, waitress, or the built-in asyncio server "
+                             "for many concurrent streams (default: dev)")
+    parser.add_argument("--threads", type=int, default=16,
+                        help="Worker threads for --server waitress/asyncio (default: 16)")
+    parser.add_argument("--connection-limit", type=int, default=200,
+                        help="Open connections accepted by --server waitress (default: 200)")
+    parser.add_argument("--timeout", type=int, default=120,
+                        help="Seconds before --server waitress/asyncio drops an idle or stalled connection (default: 120)")
     parser.add_argument("--update", action="store_true", help="Update to latest version")
     args = parser.parse_args()
+    if args.bandwidth < 0 or args.client_bandwidth < 0:
+        parser.error("bandwidth limits can't be negative")
 
     if args.update:
         update_script()
         return
 
+    if args.server == 'waitress' and importlib.util.find_spec('waitress') is None:
+        print("--server waitress needs the waitress package: pip install waitress")
+        return
+
     register_signal_handlers()
 
     shared_dir = args.dir
     allow_delete = not args.disable_delete  # <-- magic line
 
     os.makedirs(args.dir, exist_ok=True)
-    app_obj = build_app(args.dir, allow_delete=allow_delete, pin=args.pin if args.pin else None)
+    app_obj = build_app(args.dir, allow_delete=allow_delete, pin=args.pin if args.pin else None,
+                        zip_compression=args.zip_compression, zip_workers=args.zip_workers,
+                        zip_cache_mb=args.zip_cache_size, dedup=args.dedup,
+                        bandwidth=args.bandwidth * 1024 * 1024 or None,
+                        client_bandwidth=args.client_bandwidth * 1024 * 1024 or None,
+                        thumb_cache_mb=args.thumb_cache_size, thumb_cache_dir=args.thumb_cache_dir,
+                        ffmpeg=args.ffmpeg)
 
     print(f"Serving directory: {args.dir}")
     print(f"Open from other devices: http://<your_local_ip>:{args.port}")
     if args.pin:
         print(f"PIN protection enabled. Users must login with PIN: {args.pin}")
     print(f"Delete enabled: {allow_delete}")
+    if args.thumb_cache_size > 0 and load_pillow() is None:
+        print("Thumbnails disabled: pip install Pillow to enable them")
+    if args.thumb_cache_size > 0 and not args.ffmpeg:
+        print("Video previews disabled: install ffmpeg to enable them")
+    if args.bandwidth or args.client_bandwidth:
+        print(f"Bandwidth limit: {args.bandwidth or 'unlimited'} MB/s total, "
+              f"{args.client_bandwidth or 'unlimited'} MB/s per client (streaming first)")
+    if args.server == 'waitress':
+        print(f"Server: waitress, {args.threads} threads, up to {args.connection_limit} connections")
+    elif args.server == 'asyncio':
+        print(f"Server: asyncio, {args.threads} app threads, file bodies sent from the event loop")
     print("Press Ctrl+C to stop the server and clean up files.")
 
     try:
-        app_obj.run(host=args.host, port=args.port, threaded=True)
+        run_server(app_obj, args.server, args.host, args.port, threads=args.threads,
+                   connection_limit=args.connection_limit, timeout=args.timeout)
     except Exception as e:
         print(f"Server error: {e}")
     finally:
@@ -0,0 +1,114 @@
+# Listing build cost: the old per-entry os.path/os.stat FileInfo vs the
+# scandir-based one in LocalShare.py.
+#
+#   python benchmarks/bench_listing.py [--entries 10000] [--rounds 5]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import LocalShare
+
+EXTENSIONS = ['.mp4', '.mkv', '.mp3', '.flac', '.jpg', '.png', '.srt', '.txt', '.pdf', '.zip']
+
+VIDEO_EXTENSIONS = ['.mp4', '.webm', '.ogg', '.mov', '.avi', '.mkv', '.flv', '.wmv', '.m4v']
+AUDIO_EXTENSIONS = ['.mp3', '.wav', '.ogg', '.m4a', '.flac', '.aac', '.wma', '.opus']
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.svg', '.ico']
+SUBTITLE_EXTENSIONS = ['.srt', '.vtt']
+
+
+class LegacyFileInfo:
+    # FileInfo as it was before the scandir rewrite
+    def __init__(self, path, base_dir):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.relpath = os.path.relpath(path, base_dir)
+        self.is_dir = os.path.isdir(path)
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.ext = os.path.splitext(self.name)[1].lower()
+
+    @property
+    def is_video(self):
+        return self.ext in VIDEO_EXTENSIONS
+
+    @property
+    def is_audio(self):
+        return self.ext in AUDIO_EXTENSIONS
+
+    @property
+    def is_image(self):
+        return self.ext in IMAGE_EXTENSIONS
+
+    @property
+    def is_subtitle(self):
+        return self.ext in SUBTITLE_EXTENSIONS
+
+
+def legacy_scan(dir_path, base_dir):
+    return [LegacyFileInfo(os.path.join(dir_path, item), base_dir) for item in os.listdir(dir_path)]
+
+
+def filter_all(files):
+    # What building the four type views touches
+    return sum(f.is_video + f.is_audio + f.is_image + f.is_subtitle for f in files)
+
+
+def best_of(rounds, fn):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def retained_bytes(fn):
+    tracemalloc.start()
+    result = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LocalShare listing builds")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="localshare-bench-")
+    try:
+        share = os.path.join(root, "share")
+        os.mkdir(share)
+        for i in range(args.entries):
+            with open(os.path.join(share, f"file_{i:06d}{EXTENSIONS[i % len(EXTENSIONS)]}"), 'wb') as f:
+                f.write(b'x' * (i % 4096))
+
+        per_10k = 10000.0 / args.entries
+        rows = [
+            ("legacy", lambda: legacy_scan(share, share)),
+            ("scandir", lambda: LocalShare.scan_directory(share, share)),
+        ]
+        print(f"{args.entries} entries, best of {args.rounds}")
+        print(f"{'':10}{'scan ms/10k':>14}{'filter ms/10k':>16}{'bytes/entry':>14}")
+        for label, scan in rows:
+            scan()  # warm the dentry cache
+            files = scan()
+            scan_s = best_of(args.rounds, scan)
+            filter_s = best_of(args.rounds, lambda: filter_all(files))
+            mem = retained_bytes(scan) / args.entries
+            print(f"{label:10}{scan_s * 1000 * per_10k:14.1f}{filter_s * 1000 * per_10k:16.2f}{mem:14.0f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
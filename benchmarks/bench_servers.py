@@ -0,0 +1,160 @@
+# Concurrent streaming load against each --server backend.
+#
+# Starts LocalShare.py on a scratch directory once per backend, has
+# --clients threads stream a media file over and over through /view (in
+# player-sized range requests on keep-alive connections), and meanwhile
+# probes /api/list to see how page loads fare under that load.
+#
+#   python benchmarks/bench_servers.py [--clients 32] [--seconds 15] [--servers dev waitress asyncio]
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'LocalShare.py')
+FILE_SIZE = 64 * 1024 * 1024
+RANGE_SIZE = 2 * 1024 * 1024
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not come up")
+
+
+def streamer(port, stop, stats, lock):
+    # One player: sequential 2 MiB range requests over a keep-alive connection
+    conn = None
+    offset = 0
+    while not stop.is_set():
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            end = min(offset + RANGE_SIZE, FILE_SIZE) - 1
+            conn.request('GET', '/view/video.mp4', headers={'Range': f'bytes={offset}-{end}'})
+            resp = conn.getresponse()
+            received = 0
+            while True:
+                chunk = resp.read(256 * 1024)
+                if not chunk:
+                    break
+                received += len(chunk)
+            if resp.status != 206:
+                raise RuntimeError(resp.status)
+            offset = 0 if end + 1 >= FILE_SIZE else end + 1
+            with lock:
+                stats['bytes'] += received
+                stats['requests'] += 1
+        except Exception:
+            with lock:
+                stats['errors'] += 1
+            if conn is not None:
+                conn.close()
+            conn = None
+            time.sleep(0.05)
+    if conn is not None:
+        conn.close()
+
+
+def prober(port, stop, latencies, lock):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            conn.request('GET', '/api/list?limit=50')
+            conn.getresponse().read()
+            conn.close()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        except Exception:
+            with lock:
+                latencies.append(float('inf'))
+        time.sleep(0.1)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(backend, clients, seconds):
+    share = tempfile.mkdtemp(prefix="localshare-bench-")
+    with open(os.path.join(share, 'video.mp4'), 'wb') as f:
+        f.write(os.urandom(1024 * 1024) * (FILE_SIZE // (1024 * 1024)))
+    for i in range(200):
+        open(os.path.join(share, f'file_{i:03d}.txt'), 'w').close()
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, SCRIPT, '--dir', share, '--port', str(port),
+                             '--host', '127.0.0.1', '--server', backend],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        stop = threading.Event()
+        lock = threading.Lock()
+        stats = {'bytes': 0, 'requests': 0, 'errors': 0}
+        latencies = []
+        threads = [threading.Thread(target=streamer, args=(port, stop, stats, lock), daemon=True)
+                   for _ in range(clients)]
+        threads.append(threading.Thread(target=prober, args=(port, stop, latencies, lock), daemon=True))
+        start = time.time()
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        elapsed = time.time() - start
+        for t in threads:
+            t.join(35)
+        return {
+            'MB/s': stats['bytes'] / elapsed / 1e6,
+            'ranges/s': stats['requests'] / elapsed,
+            'errors': stats['errors'],
+            'list p50 ms': percentile(latencies, 0.5) * 1000,
+            'list p95 ms': percentile(latencies, 0.95) * 1000,
+            'list max ms': max(latencies or [float('nan')]) * 1000,
+        }
+    finally:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(share, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LocalShare server backends")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=int, default=15)
+    parser.add_argument("--servers", nargs='+', default=['dev', 'waitress', 'asyncio'])
+    args = parser.parse_args()
+
+    print(f"{args.clients} streaming clients, {args.seconds}s per backend")
+    results = {backend: run(backend, args.clients, args.seconds) for backend in args.servers}
+    columns = list(next(iter(results.values())))
+    print(f"{'':10}" + ''.join(f"{c:>14}" for c in columns))
+    for backend, row in results.items():
+        print(f"{backend:10}" + ''.join(f"{row[c]:14.1f}" for c in columns))
+
+
+if __name__ == '__main__':
+    main()